@@ -1,17 +1,48 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connections
+from django.db.models import F, Q
 from django_filters import rest_framework as filters
 from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+
+from .search import ingredient_index
+
+SEARCH_CONFIG = 'russian'
 
 
 class IngredientFilter(SearchFilter):
-    """ Фильтр ингредиентов по названию """
+    """
+    Фильтр ингредиентов по названию.
+    Список ищется по индексу в памяти: сначала совпадения по началу
+    названия, затем по подстроке, не больше limit результатов.
+    """
     search_param = 'name'
+    limit_param = 'limit'
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_param, '')
+        max_limit = settings.INGREDIENT_SEARCH_LIMIT
+        if limit.isdigit() and 0 < int(limit) < max_limit:
+            return int(limit)
+        return max_limit
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query or view.action != 'list':
+            return super().filter_queryset(request, queryset, view)
+        return ingredient_index.search(query, self.get_limit(request))
 
 
 class RecipeFilter(filters.FilterSet):
     """ фильтрация по тегам/избранному/автору/наличию списка покупок! """
     tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.OrderingFilter(
+        fields=(('pub_date', 'pub_date'), ('favorites_count', 'popular')),
+    )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
     )
@@ -21,14 +52,44 @@ class RecipeFilter(filters.FilterSet):
 
     def get_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favoriterecipe__user=self.request.user)
+            return queryset.filter(
+                user_relations__user=self.request.user,
+                user_relations__kind=FavoriteRecipe.KIND,
+            )
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
-            return queryset.filter(shoppingcart__user=self.request.user)
-        return
+            return queryset.filter(
+                user_relations__user=self.request.user,
+                user_relations__kind=ShoppingCart.KIND,
+            )
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию и описанию рецепта с учетом
+        опечаток в названии, результаты упорядочены по релевантности.
+        Без PostgreSQL ищет вхождение подстроки.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        if connections[queryset.db].vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            )
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_similar=value)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query),
+            similarity=TrigramSimilarity('name', value),
+        ).order_by('-rank', '-similarity', '-pub_date')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',)
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering',)
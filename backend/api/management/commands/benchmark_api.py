@@ -0,0 +1,284 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from itertools import combinations
+from statistics import median, quantiles
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from foodgram.settings import BASE_DIR
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.images import wait_for_variants
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+BUDGET = os.path.join(BASE_DIR, 'data', 'benchmark_budget.json')
+METRICS = ('p95_ms', 'queries', 'peak_kib')
+
+
+def small_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), '#49B64E').save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a fixed dataset in a test database and measures latency, '
+        'SQL queries and peak memory of the hot API endpoints'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Number of timed requests for each endpoint',
+        )
+        parser.add_argument(
+            '--only', nargs='+', default=(),
+            help='Run only endpoints whose names contain these strings',
+        )
+        parser.add_argument(
+            '--output', help='Save results to this JSON file',
+        )
+        parser.add_argument(
+            '--compare', help='Print changes against a saved JSON file',
+        )
+        parser.add_argument(
+            '--budget', nargs='?', const=BUDGET,
+            help='Fail if results exceed the budget file '
+                 '(data/benchmark_budget.json by default)',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the test database and its data between runs',
+        )
+
+    def handle(self, *args, **options):
+        """
+        Картинки загружаемых и сгенерированных рецептов и их варианты
+        пишутся во временный каталог, который удаляется вместе
+        с тестовой базой.
+        """
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        media = tempfile.mkdtemp(prefix='benchmark-media-')
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media):
+                try:
+                    if not Recipe.objects.exists():
+                        self.stdout.write('Генерация данных...')
+                        call_command(
+                            'generate_data', users=options['users'],
+                            recipes=options['recipes'],
+                            seed=options['seed'], stdout=io.StringIO(),
+                        )
+                    results = self.run_endpoints(options)
+                finally:
+                    wait_for_variants()
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+            shutil.rmtree(media, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'date': timezone.now().isoformat(),
+                'vendor': connection.vendor,
+                'users': options['users'],
+                'recipes': options['recipes'],
+                'seed': options['seed'],
+                'repeat': options['repeat'],
+            },
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self.compare(results, options['compare'])
+        if options['budget']:
+            self.check_budget(results, options['budget'])
+
+    def endpoints(self):
+        """ Пары (имя, функция запроса) для замеров. """
+        user = User.objects.annotate(
+            cart=Count('recipe_relations')
+        ).order_by('-cart', 'pk').first()
+        author = User.objects.order_by('-recipes_count', 'pk').first()
+        recipe = Recipe.objects.order_by('-favorites_count', 'pk').first()
+        tag = Tag.objects.order_by('pk').first()
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)[:3]
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous = APIClient()
+
+        filters = {
+            'tags': f'tags={tag.slug}',
+            'author': f'author={author.pk}',
+            'favorited': 'is_favorited=1',
+            'cart': 'is_in_shopping_cart=1',
+            'search': 'search=суп',
+            'popular': 'ordering=-popular',
+        }
+        yield 'recipes-list[anonymous]', lambda: anonymous.get(
+            '/api/recipes/'
+        )
+        for size in range(len(filters) + 1):
+            for names in combinations(filters, size):
+                query = '&'.join(filters[name] for name in names)
+                yield (
+                    f'recipes-list[{",".join(names) or "all"}]',
+                    lambda query=query: client.get(f'/api/recipes/?{query}'),
+                )
+        yield 'recipe-retrieve', lambda: client.get(
+            f'/api/recipes/{recipe.pk}/'
+        )
+        yield 'subscriptions', lambda: client.get(
+            '/api/users/subscriptions/?recipes_limit=3'
+        )
+        for file_format in ('txt', 'csv', 'pdf'):
+            yield (
+                f'download-shopping-cart[{file_format}]',
+                lambda file_format=file_format: client.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': file_format},
+                ),
+            )
+        yield 'ingredient-search', lambda: client.get(
+            '/api/ingredients/', {'name': 'мол'}
+        )
+
+        payload = {
+            'tags': [tag.pk],
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in ingredients
+            ],
+            'name': 'Бенчмарк',
+            'image': small_image(),
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+        own = Recipe.objects.filter(author=user).order_by('pk').first()
+        yield 'recipe-create', lambda: client.post(
+            '/api/recipes/', payload, format='json'
+        )
+        if own is not None:
+            yield 'recipe-update', lambda: client.patch(
+                f'/api/recipes/{own.pk}/', payload, format='json'
+            )
+
+    def measure(self, request):
+        """ Задержки по repeat запросам, число запросов и пик памяти. """
+        timings = []
+        queries = 0
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'Ответ {response.status_code}: {response.content[:200]}'
+                )
+            queries = max(queries, len(context.captured_queries))
+        tracemalloc.start()
+        response = request()
+        if response.streaming:
+            b''.join(response.streaming_content)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        timings.sort()
+        p95 = (
+            quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        )
+        return {
+            'p50_ms': round(median(timings) * 1000, 2),
+            'p95_ms': round(p95 * 1000, 2),
+            'queries': queries,
+            'peak_kib': round(peak / 1024),
+        }
+
+    def run_endpoints(self, options):
+        self.repeat = max(options['repeat'], 1)
+        results = {}
+        for name, request in self.endpoints():
+            if options['only'] and not any(
+                part in name for part in options['only']
+            ):
+                continue
+            results[name] = self.measure(request)
+            result = results[name]
+            self.stdout.write(
+                f'{name:<45} p50 {result["p50_ms"]:>8.1f} ms  '
+                f'p95 {result["p95_ms"]:>8.1f} ms  '
+                f'{result["queries"]:>3} SQL  '
+                f'{result["peak_kib"]:>6} KiB'
+            )
+        return results
+
+    def compare(self, results, path):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            old = previous[name]
+            change = (
+                (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+                if old['p95_ms'] else 0
+            )
+            self.stdout.write(
+                f'{name:<45} p95 {change:+6.1f}%  '
+                f'SQL {old["queries"]} -> {result["queries"]}'
+            )
+
+    def check_budget(self, results, path):
+        """
+        Бюджет - json {имя: {метрика: предел}}. Ключ "*" задает
+        пределы для всех замеров без собственной записи.
+        """
+        with open(path, encoding='utf-8') as file:
+            budget = json.load(file)
+        violations = []
+        for name, result in results.items():
+            limits = budget.get(name, budget.get('*', {}))
+            for metric in METRICS:
+                limit = limits.get(metric)
+                if limit is not None and result[metric] > limit:
+                    violations.append(
+                        f'{name}: {metric} {result[metric]} > {limit}'
+                    )
+        if violations:
+            raise CommandError(
+                'Превышен бюджет:\n' + '\n'.join(violations)
+            )
+        self.stdout.write(self.style.SUCCESS('Бюджет соблюден'))
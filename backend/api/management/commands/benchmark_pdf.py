@@ -0,0 +1,54 @@
+import time
+import tracemalloc
+from statistics import median
+
+from django.core.management.base import BaseCommand
+
+from api.utils import PDFGenerator
+
+
+class NullWriter:
+    """ Приемник pdf, который только считает записанные байты. """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class Command(BaseCommand):
+    help = 'Measures PDF shopping list latency and peak memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lines', nargs='+', type=int, default=[10, 100, 1000],
+            help='Number of lines in generated documents',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Number of documents generated for each size',
+        )
+
+    def handle(self, *args, **options):
+        generator = PDFGenerator('benchmark.pdf')
+        for lines in options['lines']:
+            text_list = [f'-- Ингредиент {i} - {i} (г)' for i in range(lines)]
+            timings = []
+            peak = size = 0
+            for _ in range(options['repeat']):
+                output = NullWriter()
+                tracemalloc.start()
+                started = time.perf_counter()
+                generator.generate(text_list, output)
+                timings.append(time.perf_counter() - started)
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                size = output.size
+            self.stdout.write(
+                f'{lines:>6} lines: '
+                f'median {median(timings) * 1000:.1f} ms, '
+                f'max {max(timings) * 1000:.1f} ms, '
+                f'peak memory {peak / 1024:.0f} KiB, '
+                f'size {size / 1024:.0f} KiB'
+            )
@@ -0,0 +1,52 @@
+import time
+from statistics import median
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.filters import RecipeFilter
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures recipe search latency on the current database. '
+        'Seed a large dataset (e.g. 1M recipes) first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'queries', nargs='*',
+            default=['курица', 'картофель с грибами', 'борш', 'салат'],
+            help='Search queries to measure',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Number of runs for each query',
+        )
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Print the query plan for each query',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{connection.vendor}, рецептов: {Recipe.objects.count()}'
+        )
+        for value in options['queries']:
+            queryset = RecipeFilter(
+                {'search': value}, queryset=Recipe.objects.all()
+            ).qs.only('id', 'name')[:6]
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                names = [recipe.name for recipe in queryset.all()]
+                timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'{value!r}: median {median(timings) * 1000:.1f} ms, '
+                f'max {max(timings) * 1000:.1f} ms, top: {names[:3]}'
+            )
+            if options['explain']:
+                analyze = {'analyze': True} if (
+                    connection.vendor == 'postgresql') else {}
+                self.stdout.write(queryset.explain(**analyze))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Builds resized variants for recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild variants for every recipe, not only missing ones',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        built = failed = 0
+        for recipe_id, image, variants in recipes.values_list(
+            'id', 'image', 'image_variants'
+        ).iterator():
+            stale = variants if options['all'] else None
+            if process_recipe_image(recipe_id, image, stale):
+                built += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {built}, с ошибками: {failed}'
+        ))
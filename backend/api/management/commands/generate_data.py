@@ -0,0 +1,343 @@
+import csv
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag, UserRecipe)
+from users.models import Follow, User
+
+from api.pagination import invalidate_counts
+from api.management.commands.import_csv import batches
+
+IMAGE_NAME = 'recipes/image/generated.png'
+PASSWORD = 'generated-password'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F0B323', 'dessert'),
+    ('Выпечка', '#C1440E', 'bakery'),
+    ('Салат', '#2E8B57', 'salad'),
+)
+DISHES = (
+    'Суп', 'Салат', 'Рагу', 'Запеканка', 'Пирог', 'Каша', 'Паста',
+    'Омлет', 'Плов', 'Котлеты', 'Рулет', 'Жаркое', 'Смузи', 'Оладьи',
+)
+STEPS = (
+    'Нарежьте {}.', 'Обжарьте {} до золотистого цвета.',
+    'Добавьте {} и перемешайте.', 'Тушите {} под крышкой.',
+    'Посыпьте блюдо: {}.', 'Подавайте с {}.',
+)
+
+
+def zipf_weights(size, alpha=1.1):
+    """
+    Накопленные веса степенного распределения: элемент ранга r
+    выбирается с вероятностью, пропорциональной 1 / r ** alpha.
+    """
+    return list(accumulate(1 / rank ** alpha for rank in range(1, size + 1)))
+
+
+def write_rows(model, fields, rows, use_copy):
+    """
+    Записывает пачку строк в таблицу модели: через COPY на PostgreSQL,
+    иначе одним executemany. Значения полей auto_now_add сохраняются.
+    """
+    table = model._meta.db_table
+    columns = [model._meta.get_field(name).column for name in fields]
+    with connection.cursor() as cursor:
+        if use_copy:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({", ".join(columns)}) '
+                'FROM STDIN WITH (FORMAT csv)', buffer
+            )
+        else:
+            cursor.executemany(
+                f'INSERT INTO {table} ({", ".join(columns)}) '
+                f'VALUES ({", ".join(["%s"] * len(columns))})', rows
+            )
+
+
+class Command(BaseCommand):
+    help = 'Generates users, follows, recipes, favorites and carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Average number of authors followed by a user',
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Average number of favorite recipes per user',
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Average number of recipes in a shopping cart',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Spread publication dates over this many days',
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of rows written per query',
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Use INSERT even on PostgreSQL',
+        )
+        parser.add_argument(
+            '--skip-feed', action='store_true',
+            help='Do not fill subscription feeds',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        tags = self.ensure_tags()
+        ingredients = self.ensure_ingredients()
+        image = self.ensure_image()
+        users = self.stage('Пользователи', self.create_users, options)
+        self.stage('Подписки', self.create_follows, users, options)
+        recipes = self.stage(
+            'Рецепты', self.create_recipes, users, tags, ingredients, image,
+            options,
+        )
+        self.stage(
+            'Избранное', self.create_relations, users, recipes,
+            FavoriteRecipe, options['favorites'],
+        )
+        self.stage(
+            'Корзины', self.create_relations, users, recipes,
+            ShoppingCart, options['cart'],
+        )
+        self.stage('Счетчики', call_command, 'reconcile_counters',
+                   stdout=io.StringIO())
+        self.stage('Списки покупок', ShoppingListItem.objects.rebuild,
+                   self.batch_size)
+        if not options['skip_feed']:
+            self.stage('Ленты подписок', self.fill_feed, users)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        invalidate_counts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с'
+        ))
+
+    def stage(self, title, function, *args, **kwargs):
+        self.stdout.write(f'{title}...')
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.stdout.write(f'  {time.perf_counter() - started:.1f} с')
+
+    def write(self, model, fields, rows):
+        """ Пишет строки пачками, каждая пачка в своей транзакции. """
+        written = 0
+        for batch in batches(rows, self.batch_size):
+            with transaction.atomic():
+                write_rows(model, fields, batch, self.use_copy)
+            written += len(batch)
+        self.stdout.write(f'  строк: {written}')
+        return written
+
+    def new_ids(self, model, start):
+        return list(
+            model.objects.filter(pk__gt=start)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def last_id(self, model):
+        return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+    def ensure_tags(self):
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                [Tag(name=name, color=color, slug=slug)
+                 for name, color, slug in TAGS],
+                ignore_conflicts=True,
+            )
+        return list(Tag.objects.values_list('pk', flat=True))
+
+    def ensure_ingredients(self):
+        if not Ingredient.objects.exists():
+            call_command('import_csv', stdout=io.StringIO())
+        return list(
+            Ingredient.objects.order_by('pk').values_list('pk', 'name')
+        )
+
+    def ensure_image(self):
+        """ Одна общая картинка для всех сгенерированных рецептов. """
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = io.BytesIO()
+            Image.new('RGB', (640, 480), '#E26C2D').save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        return IMAGE_NAME
+
+    def between(self, low, high):
+        """ Быстрая замена randint для миллионов вызовов. """
+        return low + int(self.rng.random() * (high - low + 1))
+
+    def random_date(self, days):
+        return connection.ops.adapt_datetimefield_value(
+            self.now - timedelta(seconds=self.rng.random() * days * 86400)
+        )
+
+    def create_users(self, options):
+        start = self.last_id(User)
+        password = make_password(PASSWORD)
+        run = f'{options["seed"]}-{start}'
+        self.write(User, (
+            'password', 'is_superuser', 'username', 'first_name',
+            'last_name', 'email', 'is_staff', 'is_active', 'date_joined',
+            'recipes_count', 'followers_count',
+        ), (
+            (password, False, f'user{run}-{number}', 'Имя', 'Фамилия',
+             f'user{run}-{number}@example.com', False, True,
+             self.random_date(options['days']), 0, 0)
+            for number in range(options['users'])
+        ))
+        return self.new_ids(User, start)
+
+    def create_follows(self, users, options):
+        """ Подписки со степенным распределением числа подписчиков. """
+        if len(users) < 2:
+            return
+        authors = users[:]
+        self.rng.shuffle(authors)
+        weights = zipf_weights(len(authors))
+
+        def follows():
+            for user in users:
+                count = self.between(0, 2 * options['follows'])
+                chosen = set(self.rng.choices(
+                    authors, cum_weights=weights, k=count
+                ))
+                chosen.discard(user)
+                for author in chosen:
+                    yield user, author
+
+        self.write(Follow, ('user', 'author'), follows())
+
+    def create_recipes(self, users, tags, ingredients, image, options):
+        """
+        Рецепты пишутся пачками: после каждой пачки берутся их id
+        и сразу пишутся ингредиенты и теги.
+        """
+        authors = users[:]
+        self.rng.shuffle(authors)
+        author_weights = zipf_weights(len(authors))
+        popular = ingredients[:]
+        self.rng.shuffle(popular)
+        ingredient_weights = zipf_weights(len(popular), alpha=0.9)
+        recipes = []
+        for batch in batches(range(options['recipes']), self.batch_size):
+            start = self.last_id(Recipe)
+            rows, contents = [], []
+            for _ in batch:
+                chosen = dict(self.rng.choices(
+                    popular, cum_weights=ingredient_weights,
+                    k=self.between(3, 12),
+                ))
+                names = list(chosen.values())
+                pub_date = self.random_date(options['days'])
+                rows.append((
+                    self.rng.choices(
+                        authors, cum_weights=author_weights
+                    )[0],
+                    f'{self.rng.choice(DISHES)}: {names[0]}'[:200],
+                    image, '{}',
+                    ' '.join(
+                        self.rng.choice(STEPS).format(name)
+                        for name in names
+                    ),
+                    self.between(5, 180), pub_date, pub_date, 0,
+                ))
+                contents.append((list(chosen), self.rng.sample(
+                    tags, self.between(1, min(3, len(tags)))
+                )))
+            with transaction.atomic():
+                write_rows(Recipe, (
+                    'author', 'name', 'image', 'image_variants', 'text',
+                    'cooking_time', 'pub_date', 'updated_at',
+                    'favorites_count',
+                ), rows, self.use_copy)
+                ids = self.new_ids(Recipe, start)
+                write_rows(RecipeIngredient, (
+                    'recipe', 'ingredient', 'amount',
+                ), [
+                    (recipe, ingredient, self.between(1, 500))
+                    for recipe, (chosen, _) in zip(ids, contents)
+                    for ingredient in chosen
+                ], self.use_copy)
+                write_rows(Recipe.tags.through, ('recipe', 'tag'), [
+                    (recipe, tag)
+                    for recipe, (_, chosen) in zip(ids, contents)
+                    for tag in chosen
+                ], self.use_copy)
+            recipes.extend(ids)
+            self.stdout.write(f'  рецептов: {len(recipes)}')
+        return recipes
+
+    def create_relations(self, users, recipes, model, average):
+        """ Избранное или корзины: популярные рецепты выбираются чаще. """
+        if not recipes:
+            return
+        popular = recipes[:]
+        self.rng.shuffle(popular)
+        weights = zipf_weights(len(popular))
+
+        def relations():
+            for user in users:
+                chosen = set(self.rng.choices(
+                    popular, cum_weights=weights,
+                    k=self.between(0, 2 * average),
+                ))
+                for recipe in chosen:
+                    yield user, recipe, model.KIND
+
+        self.write(UserRecipe, ('user', 'recipe', 'kind'), relations())
+
+    def fill_feed(self, users):
+        """ Заполняет ленты новых пользователей одним INSERT ... SELECT. """
+        if not users:
+            return
+        feed = FeedEntry._meta.db_table
+        follow = Follow._meta.db_table
+        recipe = Recipe._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {feed} (user_id, recipe_id, pub_date) '
+                f'SELECT f.user_id, r.id, r.pub_date FROM {follow} f '
+                f'JOIN {recipe} r ON r.author_id = f.author_id '
+                'WHERE f.user_id BETWEEN %s AND %s',
+                [users[0], users[-1]],
+            )
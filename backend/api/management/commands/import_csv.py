@@ -1,29 +1,155 @@
 import csv
+import io
+import json
 import os
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 from foodgram.settings import BASE_DIR
 
+from api.mixins import touch_related
+from api.search import ingredient_index
 from recipes.models import Ingredient
 
+HEADER = ['name', 'measurement_unit']
 
-def ingredients_down(path):
-    with open(path, encoding="utf-8") as csv_file:
-        reader = csv.reader(csv_file)
-        next(reader)
-        print('Создание ингредиентов...')
-        for row in reader:
-            Ingredient.objects.create(
-                name=row[0],
-                measurement_unit=row[1]
-            )
-        print('Выполнено')
+
+def read_csv(file):
+    """ Построчно читает ингредиенты из csv, строка заголовка пропускается. """
+    for row in csv.reader(file):
+        if len(row) < 2 or row[:2] == HEADER:
+            continue
+        yield row[0].strip(), row[1].strip()
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """
+    Читает ингредиенты из json-массива объектов по частям,
+    не загружая файл в память целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается json-массив ингредиентов')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise CommandError('Файл json оборван')
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        yield item['name'].strip(), item['measurement_unit'].strip()
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_bulk(batch):
+    Ingredient.objects.bulk_create(
+        [Ingredient(name=name, measurement_unit=unit)
+         for name, unit in batch],
+        ignore_conflicts=True,
+    )
+
+
+def import_copy(batch):
+    """
+    Загружает пачку через COPY во временную таблицу и переносит
+    новые строки в таблицу ингредиентов, пропуская существующие.
+    """
+    table = Ingredient._meta.db_table
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE ingredients_import '
+            '(name varchar(200), measurement_unit varchar(200)) '
+            'ON COMMIT DROP'
+        )
+        cursor.copy_expert(
+            'COPY ingredients_import FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT DISTINCT name, measurement_unit FROM ingredients_import '
+            'ON CONFLICT DO NOTHING'
+        )
 
 
 class Command(BaseCommand):
-    help = 'Loads ingredients from CSV file'
+    help = 'Loads ingredients from CSV or JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(BASE_DIR, 'data/ingredients.csv'),
+            help='Path to ingredients file',
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='File format, detected by extension by default',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows inserted per query',
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Use bulk_create even on PostgreSQL',
+        )
 
     def handle(self, *args, **options):
-        path_to_file = os.path.join(BASE_DIR, 'data/ingredients.csv')
-        print(path_to_file)
-        ingredients_down(path_to_file)
+        path = options['path']
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in ('csv', 'json'):
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        load_batch = import_copy if use_copy else import_bulk
+        reader = read_csv if file_format == 'csv' else read_json
+
+        self.stdout.write(f'Создание ингредиентов из {path}...')
+        before = Ingredient.objects.count()
+        started = time.perf_counter()
+        processed = 0
+        with open(path, encoding='utf-8') as file:
+            for batch in batches(reader(file), options['batch_size']):
+                with transaction.atomic():
+                    load_batch(batch)
+                processed += len(batch)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'  обработано {processed} строк, '
+                    f'{processed / elapsed:.0f} строк/с'
+                )
+        created = Ingredient.objects.count() - before
+        if created:
+            # COPY и bulk_create не отправляют сигналы модели: индекс
+            # автодополнения и ETag сбрасываются во всех процессах
+            # через общую версию связанных данных.
+            ingredient_index.invalidate()
+            touch_related()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено: {processed} строк, добавлено {created}, '
+            f'{elapsed:.2f} с'
+        ))
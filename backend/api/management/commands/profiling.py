@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.profiling import is_enabled, set_enabled
+
+
+class Command(BaseCommand):
+    help = (
+        'Turns request profiling (Server-Timing header and slow request '
+        'log) on or off without a restart'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'state', nargs='?', choices=('on', 'off', 'status'),
+            default='status',
+        )
+
+    def handle(self, *args, **options):
+        state = options['state']
+        if state != 'status':
+            set_enabled(state == 'on')
+        enabled = 'включено' if is_enabled() else 'выключено'
+        self.stdout.write(f'Профилирование {enabled}.')
+        if state != 'status':
+            self.stdout.write(
+                'Процессы приложения увидят изменение в течение '
+                f'{settings.PROFILING_SWITCH_TTL} с.'
+            )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Checks and rebuilds aggregated shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only compare stored lists with carts, do not rebuild',
+        )
+
+    def handle(self, *args, **options):
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            ).iterator()
+        }
+        live = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.live_amounts().iterator()
+        }
+        drift = {
+            key for key in stored.keys() | live.keys()
+            if stored.get(key) != live.get(key)
+        }
+        for user_id, ingredient_id in sorted(drift)[:20]:
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'stored {stored.get((user_id, ingredient_id))}, '
+                f'expected {live.get((user_id, ingredient_id))}'
+            )
+        self.stdout.write(f'Расхождений: {len(drift)}')
+        if options['check']:
+            if drift:
+                raise CommandError('Списки покупок не совпадают с корзинами')
+            return
+        with transaction.atomic():
+            ShoppingListItem.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
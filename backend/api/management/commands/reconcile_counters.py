@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe
+from users.models import Follow, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(model, field):
+    """ Подзапрос с настоящим количеством связанных объектов. """
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field)
+        .annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Checks and fixes denormalized favorites/recipes/followers counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report counters that drifted, do not fix them',
+        )
+
+    def handle(self, *args, **options):
+        drift_total = 0
+        for model, counter, related, field in COUNTERS:
+            drifted = model.objects.annotate(
+                actual=actual_count(related, field)
+            ).exclude(**{counter: F('actual')})
+            drift = drifted.count()
+            drift_total += drift
+            self.stdout.write(
+                f'{model._meta.model_name}.{counter}: расхождений {drift}'
+            )
+            if drift and not options['check']:
+                with transaction.atomic():
+                    model.objects.filter(
+                        pk__in=drifted.values('pk')
+                    ).update(**{counter: actual_count(related, field)})
+        if options['check'] and drift_total:
+            raise CommandError('Счетчики расходятся с данными')
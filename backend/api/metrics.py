@@ -0,0 +1,357 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Number of HTTP requests.', None,
+    ),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Time to build a response.', LATENCY_BUCKETS,
+    ),
+    'foodgram_http_db_duration_seconds': (
+        'histogram', 'Time spent in SQL queries per request.',
+        LATENCY_BUCKETS,
+    ),
+    'foodgram_http_db_queries_total': (
+        'counter', 'Number of SQL queries.', None,
+    ),
+    'foodgram_http_response_size_bytes': (
+        'histogram', 'Size of the response body.', SIZE_BUCKETS,
+    ),
+}
+FILE_PREFIX = 'metrics-'
+DEAD_FILE = f'{FILE_PREFIX}dead.json'
+
+
+def view_label(view_func, method):
+    """
+    Имя вида для меток: класс и действие для DRF (RecipeViewSet.list,
+    CustomUserViewSet.subscriptions), иначе модуль и имя функции.
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower(), method.lower())
+    return f'{cls.__name__}.{action}'
+
+
+def merge(values, name, labels, value):
+    """ Складывает значение счетчика или гистограммы в словарь. """
+    key = (name, labels)
+    if key not in values:
+        values[key] = value
+    elif isinstance(value, list):
+        values[key] = [old + new for old, new in zip(values[key], value)]
+    else:
+        values[key] += value
+
+
+def read_values(path):
+    """ Метрики из файла процесса или {} для пустого/битого файла. """
+    try:
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    values = {}
+    for metric, labels, value in data:
+        if metric in METRICS:
+            merge(values, metric, tuple(tuple(pair) for pair in labels), value)
+    return values
+
+
+def write_values(path, values):
+    """ Атомарно записывает метрики в файл. """
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump([
+            [name, labels, value]
+            for (name, labels), value in values.items()
+        ], file)
+    os.replace(temporary, path)
+
+
+def is_alive(pid):
+    """ Проверяет, что процесс с таким pid еще существует. """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    Метрики процесса. Каждый процесс периодически сохраняет их
+    в свой файл metrics-<pid>.json в METRICS_DIR, при выдаче файлы
+    всех процессов складываются. Файлы завершившихся процессов
+    переносятся в общий итог metrics-dead.json, поэтому счетчики
+    не теряются и не уменьшаются. Без METRICS_DIR видны только
+    метрики процесса, который отвечает на запрос.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flushed = 0.0
+        self.pid = None
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            merge(self.values, name, labels, amount)
+
+    def observe(self, name, labels, value):
+        """
+        Гистограмма хранится как счетчики по корзинам (последняя -
+        +Inf) и сумма наблюдений.
+        """
+        buckets = METRICS[name][2]
+        entry = [0] * (len(buckets) + 2)
+        entry[bisect_left(buckets, value)] = 1
+        entry[-1] = value
+        with self.lock:
+            merge(self.values, name, labels, entry)
+
+    def path(self, pid=None):
+        return os.path.join(
+            settings.METRICS_DIR, f'{FILE_PREFIX}{pid or os.getpid()}.json'
+        )
+
+    @contextmanager
+    def directory_lock(self):
+        """ Блокировка каталога метрик между процессами. """
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        with open(
+            os.path.join(settings.METRICS_DIR, '.lock'), 'a'
+        ) as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def archive(self, pid):
+        """
+        Переносит метрики процесса pid в итог завершившихся процессов.
+        Вызывается под directory_lock.
+        """
+        path = self.path(pid)
+        if not os.path.exists(path):
+            return
+        dead = read_values(os.path.join(settings.METRICS_DIR, DEAD_FILE))
+        for (name, labels), value in read_values(path).items():
+            merge(dead, name, labels, value)
+        write_values(os.path.join(settings.METRICS_DIR, DEAD_FILE), dead)
+        os.remove(path)
+
+    def start(self):
+        """
+        Первая запись в новом процессе: файл с тем же pid остался
+        от завершившегося процесса и переносится в общий итог.
+        """
+        with self.directory_lock():
+            self.archive(os.getpid())
+        self.pid = os.getpid()
+
+    def flush(self, force=False):
+        """ Сохраняет метрики не чаще раза в METRICS_FLUSH_INTERVAL. """
+        now = time.monotonic()
+        if not settings.METRICS_DIR or (
+            not force
+            and now - self.flushed < settings.METRICS_FLUSH_INTERVAL
+        ):
+            return
+        if self.pid != os.getpid():
+            self.start()
+        self.flushed = now
+        with self.lock:
+            values = dict(self.values)
+        write_values(self.path(), values)
+
+    def close(self):
+        """ Сохраняет метрики завершающегося процесса в общий итог. """
+        if not settings.METRICS_DIR or self.pid != os.getpid():
+            return
+        self.flush(force=True)
+        with self.directory_lock():
+            self.archive(os.getpid())
+        self.pid = None
+
+    def collect(self):
+        """
+        Метрики этого процесса вместе с файлами остальных. Файлы
+        процессов, которых больше нет, переносятся в общий итог.
+        """
+        with self.lock:
+            values = dict(self.values)
+        if not settings.METRICS_DIR:
+            return values
+        own = os.path.basename(self.path())
+        with self.directory_lock():
+            for name in os.listdir(settings.METRICS_DIR):
+                pid = name[len(FILE_PREFIX):-len('.json')]
+                if (
+                    name == own or not name.startswith(FILE_PREFIX)
+                    or not name.endswith('.json') or not pid.isdigit()
+                ):
+                    continue
+                if not is_alive(int(pid)):
+                    self.archive(int(pid))
+            for name in os.listdir(settings.METRICS_DIR):
+                if (
+                    name == own or not name.startswith(FILE_PREFIX)
+                    or not name.endswith('.json')
+                ):
+                    continue
+                path = os.path.join(settings.METRICS_DIR, name)
+                for (metric, labels), value in read_values(path).items():
+                    merge(values, metric, labels, value)
+        return values
+
+
+registry = Registry()
+atexit.register(registry.close)
+
+
+def format_labels(labels):
+    def escape(value):
+        return (
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n')
+        )
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels)
+
+
+def exposition(values):
+    """ Текстовый формат Prometheus. """
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        series = sorted(
+            (labels, value) for (metric, labels), value in values.items()
+            if metric == name
+        )
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in series:
+            if kind == 'counter':
+                lines.append(f'{name}{{{format_labels(labels)}}} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket'
+                    f'{{{format_labels(labels + (("le", bound),))}}} '
+                    f'{cumulative}'
+                )
+            text = format_labels(labels)
+            lines.append(f'{name}_sum{{{text}}} {value[-1]}')
+            lines.append(f'{name}_count{{{text}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """ Метрики всех процессов для локального сборщика. """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    registry.flush(force=True)
+    return HttpResponse(
+        exposition(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+class QueryTimer:
+    """ Обертка execute_wrapper: число и время SQL-запросов. """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+
+def counted(content, observe):
+    """ Отдает потоковый ответ, считая его размер. """
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        observe(size)
+
+
+class MetricsMiddleware:
+    """
+    Число запросов, задержки, время в базе и размер ответов
+    с метками вида, метода и статуса.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        labels = (
+            ('view', getattr(request, 'metrics_view', 'unmatched')),
+            ('method', request.method),
+            ('status', str(response.status_code)),
+        )
+        registry.inc('foodgram_http_requests_total', labels)
+        registry.observe(
+            'foodgram_http_request_duration_seconds', labels, duration
+        )
+        registry.observe(
+            'foodgram_http_db_duration_seconds', labels, timer.duration
+        )
+        registry.inc('foodgram_http_db_queries_total', labels, timer.queries)
+        if response.streaming:
+            response.streaming_content = counted(
+                response.streaming_content,
+                lambda size: registry.observe(
+                    'foodgram_http_response_size_bytes', labels, size
+                ),
+            )
+        else:
+            registry.observe(
+                'foodgram_http_response_size_bytes', labels,
+                len(response.content),
+            )
+        registry.flush()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_label(view_func, request.method)
@@ -0,0 +1,76 @@
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+RELATED_VERSION_KEY = 'recipe-related-version'
+
+
+def related_version():
+    """
+    Время последнего изменения тегов, ингредиентов или данных авторов
+    в наносекундах. Эти строки входят в ответ о рецепте, но не меняют
+    дату изменения самого рецепта. Хранится в кэше control, общем
+    для процессов и не вытесняющем записи.
+    """
+    return caches['control'].get_or_set(
+        RELATED_VERSION_KEY, time.time_ns, None
+    )
+
+
+def related_modified():
+    """ related_version в виде даты для Last-Modified. """
+    return datetime.fromtimestamp(related_version() / 1e9, timezone.utc)
+
+
+def touch_related():
+    """ Отмечает изменение тегов, ингредиентов или авторов. """
+    caches['control'].set(RELATED_VERSION_KEY, time.time_ns(), None)
+
+
+def make_etag(*parts):
+    """ Строит ETag из значений, от которых зависит ответ. """
+    return quote_etag(md5(repr(parts).encode()).hexdigest())
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 Not Modified на условные GET-запросы до сериализации.
+    Валидаторы ответа задаются методами get_etag и get_last_modified.
+    """
+
+    def get_etag(self, request):
+        return None
+
+    def get_last_modified(self, request):
+        return None
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        last_modified = self.get_last_modified(request)
+        if last_modified is not None:
+            last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if etag and response.status_code in (200, 304):
+            response['ETag'] = etag
+        if last_modified and response.status_code in (200, 304):
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs
+        )
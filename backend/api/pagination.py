@@ -1,7 +1,287 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+COUNT_VERSION_KEY = 'pagination-count-version'
+COUNT_KEYS_KEY = 'pagination-count-keys'
+
+
+def count_version():
+    """
+    Версия закешированных количеств. Хранится в кэше control, который
+    не вытесняет записи, и видна всем процессам. Версией служит время
+    записи, а не счетчик: incr файлового кэша не атомарен.
+    """
+    return caches['control'].get_or_set(COUNT_VERSION_KEY, time.time_ns, None)
+
+
+def invalidate_counts():
+    """
+    Сбрасывает закешированные количества объектов после записи во всех
+    процессах: меняет версию и удаляет из кэша counts количества старой
+    версии по их списку.
+    """
+    control = caches['control']
+    version = control.get(COUNT_VERSION_KEY)
+    control.set(COUNT_VERSION_KEY, time.time_ns(), None)
+    if version is None:
+        return
+    counts = caches['counts']
+    keys = counts.get(COUNT_KEYS_KEY, set(), version=version)
+    counts.delete_many([*keys, COUNT_KEYS_KEY], version=version)
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа строк таблицы по статистике планировщика PostgreSQL.
+    Возвращает None, если оценка недоступна.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class CountedPaginator(DjangoPaginator):
+    """ Paginator с заранее известным количеством объектов. """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @property
+    def count(self):
+        return self._count
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу: страница выбирается условием на поля ordering
+    крайней записи предыдущей страницы, без OFFSET и COUNT(*).
+    Курсор хранит значения этих полей и направление перехода.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 24
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        limit = request.query_params.get(self.page_size_query_param, '')
+        if limit.isdigit() and int(limit) > 0:
+            return min(int(limit), self.max_page_size)
+        return self.page_size
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor['v'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value
+            )
+        cursor = json.dumps({'v': values, 'r': int(reverse)})
+        return replace_query_param(
+            self.base_url, self.cursor_query_param,
+            urlsafe_b64encode(cursor.encode()).decode(),
+        )
+
+    def get_keyset_filter(self, values, reverse):
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        ordering = self.ordering
+        reverse = cursor is not None and cursor[1]
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        try:
+            if cursor is not None:
+                queryset = queryset.filter(
+                    self.get_keyset_filter(*cursor)
+                )
+            results = list(queryset.order_by(*ordering)[:page_size + 1])
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        self.has_next = has_more or reverse
+        self.has_previous = has_more if reverse else cursor is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class FeedPagination(KeysetPagination):
+    """ Пагинация ленты подписок по индексу записей ленты. """
+    ordering = ('-pub_date', '-recipe_id')
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничная пагинация. С параметром cursor (пустой — первая
+    страница) переключается на пагинацию по ключу: по сортировке
+    фильтров и keyset_ordering представления.
+    Количество объектов кешируется по набору фильтров и пользователю
+    и сбрасывается при записи; для больших таблиц без фильтров
+    анонимным пользователям отдается оценка планировщика.
+    """
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 24
+    cursor_query_param = 'cursor'
+    unsupported_ordering_message = (
+        'Курсор нельзя сочетать с сортировкой по релевантности поиска, '
+        'используйте параметр page.'
+    )
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.django_paginator_class = partial(
+                CountedPaginator, count=self.get_count(queryset, request)
+            )
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination()
+        self.keyset.ordering = self.get_keyset_ordering(queryset, view)
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_keyset_ordering(self, queryset, view):
+        """
+        Сортировка, заданная фильтрами (например ordering=-popular),
+        дополненная keyset_ordering представления для однозначности.
+        По вычисляемым значениям (релевантность поиска) курсор
+        не строится: такой запрос отклоняется.
+        """
+        ordering = []
+        for field in queryset.query.order_by:
+            name = field.lstrip('-') if isinstance(field, str) else ''
+            try:
+                concrete = queryset.model._meta.get_field(name).concrete
+            except FieldDoesNotExist:
+                concrete = False
+            if not concrete:
+                raise ParseError(self.unsupported_ordering_message)
+            ordering.append(field)
+        names = {field.lstrip('-') for field in ordering}
+        ordering.extend(
+            field for field in getattr(
+                view, 'keyset_ordering', KeysetPagination.ordering
+            ) if field.lstrip('-') not in names
+        )
+        return tuple(ordering)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_count_key(self, request):
+        params = sorted(
+            (key, values) for key, values in request.query_params.lists()
+            if key not in (self.page_query_param,
+                           self.page_size_query_param)
+        )
+        digest = md5(
+            repr((request.path, params, request.user.id)).encode()
+        ).hexdigest()
+        return f'pagination-count:{digest}'
+
+    def get_count(self, queryset, request):
+        if request.user.is_anonymous and not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if (estimate is not None
+                    and estimate > settings.PAGINATION_ESTIMATE_THRESHOLD):
+                return estimate
+        counts = caches['counts']
+        key = self.get_count_key(request)
+        version = count_version()
+        count = counts.get(key, version=version)
+        if count is None:
+            count = queryset.count()
+            counts.set(
+                key, count, settings.PAGINATION_COUNT_TTL, version=version
+            )
+            keys = counts.get(COUNT_KEYS_KEY, set(), version=version)
+            if key not in keys:
+                counts.set(
+                    COUNT_KEYS_KEY, keys | {key}, None, version=version
+                )
+        return count
@@ -0,0 +1,170 @@
+import json
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+SWITCH_KEY = 'profiling:enabled'
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+PLACEHOLDER_LISTS = re.compile(r'\((?:%s|\?)(?:,\s*(?:%s|\?))*\)')
+
+logger = logging.getLogger('api.profiling')
+current = ContextVar('profile', default=None)
+switch = {'enabled': None, 'checked': 0.0}
+
+
+def fingerprint(sql):
+    """
+    Отпечаток запроса: литералы и списки параметров заменены,
+    чтобы запросы, отличающиеся только значениями, совпадали.
+    """
+    return PLACEHOLDER_LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+def set_enabled(enabled):
+    """ Включает или выключает профилирование во всех процессах. """
+    caches['control'].set(SWITCH_KEY, bool(enabled), None)
+    switch['checked'] = 0.0
+
+
+def is_enabled():
+    """
+    Переключатель хранится в кэше control, который не вытесняет
+    записи, и перечитывается не чаще раза в PROFILING_SWITCH_TTL
+    секунд. Без записи в кэше действует настройка PROFILING_ENABLED.
+    """
+    now = time.monotonic()
+    if now - switch['checked'] >= settings.PROFILING_SWITCH_TTL:
+        enabled = caches['control'].get(SWITCH_KEY)
+        if enabled is None:
+            enabled = settings.PROFILING_ENABLED
+        switch['enabled'] = enabled
+        switch['checked'] = now
+    return switch['enabled']
+
+
+@contextmanager
+def timed(phase):
+    """
+    Добавляет время блока к фазе текущего запроса. Вложенные блоки
+    той же фазы не учитываются повторно. Без профилирования ничего
+    не делает.
+    """
+    profile = current.get()
+    if profile is None or phase in profile.active:
+        yield
+        return
+    profile.active.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.phases[phase] += time.perf_counter() - started
+        profile.active.discard(phase)
+
+
+class RequestProfile:
+    """ Запросы к базе и время фаз одного HTTP-запроса. """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints = Counter()
+        self.phases = defaultdict(float)
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def duplicates(self, limit=5):
+        return [
+            {'sql': sql, 'count': count}
+            for sql, count in self.fingerprints.most_common(limit)
+            if count > 1
+        ]
+
+    def server_timing(self, total):
+        duplicated = sum(
+            count - 1 for count in self.fingerprints.values() if count > 1
+        )
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="{self.queries} queries, {duplicated} duplicated"'
+        ]
+        metrics.extend(
+            f'{phase};dur={duration * 1000:.1f}'
+            for phase, duration in self.phases.items()
+        )
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+class ProfilingMiddleware:
+    """
+    Считает запросы к базе, их время и повторы, время сериализации,
+    рендеринга и обработки картинок. Результат отдается заголовком
+    Server-Timing, медленные запросы пишутся в лог api.profiling.
+    Время чтения потоковых ответов (txt, csv) сюда не входит.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_enabled():
+            return self.get_response(request)
+        profile = RequestProfile()
+        token = current.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(profile)
+                    )
+                response = self.get_response(request)
+        finally:
+            current.reset(token)
+        total = profile.total
+        request.profile = profile
+        response['Server-Timing'] = profile.server_timing(total)
+        if total * 1000 >= settings.PROFILING_SLOW_MS:
+            self.log_slow(request, response, profile, total)
+        return response
+
+    def log_slow(self, request, response, profile, total):
+        match = request.resolver_match
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_ms': round(profile.db_time * 1000, 1),
+            'queries': profile.queries,
+            'phases_ms': {
+                phase: round(duration * 1000, 1)
+                for phase, duration in profile.phases.items()
+            },
+            'duplicates': profile.duplicates(),
+        }
+        logger.warning(
+            'slow request %s', json.dumps(record, ensure_ascii=False),
+            extra={'profile': record},
+        )
@@ -0,0 +1,44 @@
+from rest_framework import renderers
+from rest_framework.renderers import BaseRenderer
+
+from .profiling import timed
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """ JSON-рендерер, время работы которого видно в профиле запроса. """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('render'):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер выгрузки списка покупок.
+    Сам список отдается потоковым ответом, рендерер нужен для выбора
+    формата по параметру format и для вывода сообщений об ошибках.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = data.get('detail', data)
+        return str(data).encode('utf-8')
+
+
+class PlainTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
@@ -0,0 +1,82 @@
+import threading
+import time
+from bisect import bisect_left
+from hashlib import md5
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+from .mixins import related_version
+
+
+class IngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса для автодополнения.
+    Справочник небольшой и меняется редко: индекс строится при первом
+    поиске и перестраивается при изменении ингредиентов: сигналами
+    в этом процессе, по related_version из общего кэша для изменений
+    в других процессах и командах импорта или по истечении ttl секунд.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._digest = None
+        self._version = None
+        self._built_at = 0
+
+    def invalidate(self):
+        self._keys = None
+
+    def _load(self, version):
+        items = sorted(
+            (name.casefold(), name, pk, unit)
+            for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator()
+        )
+        self._items = [
+            Ingredient(id=pk, name=name, measurement_unit=unit)
+            for _, name, pk, unit in items
+        ]
+        self._keys = [item[0] for item in items]
+        self._digest = md5(repr(items).encode()).hexdigest()
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def _get(self):
+        version = related_version()
+        with self._lock:
+            if (self._keys is None or self._version != version
+                    or time.monotonic() - self._built_at > self.ttl):
+                self._load(version)
+            return self._keys, self._items, self._digest
+
+    @property
+    def digest(self):
+        """ Контрольная сумма справочника для ETag ответов. """
+        return self._get()[2]
+
+    def search(self, query, limit):
+        """
+        Возвращает не больше limit ингредиентов: сначала названия,
+        начинающиеся с query, затем содержащие query, без учета регистра.
+        """
+        keys, items, _ = self._get()
+        query = query.casefold()
+        start = end = bisect_left(keys, query)
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        result = items[start:end][:limit]
+        for position, key in enumerate(keys):
+            if len(result) >= limit:
+                break
+            if query in key and not start <= position < end:
+                result.append(items[position])
+        return result
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_TTL)
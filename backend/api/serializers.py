@@ -1,13 +1,91 @@
+from django.core.files.storage import default_storage
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.db.models import F, Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
-from rest_framework import serializers, status
-from rest_framework.validators import ValidationError
+from rest_framework import serializers
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from recipes.images import schedule_variants
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag)
 from users.models import Follow, User
 
+from .profiling import timed
+
+
+def get_subscriptions(request):
+    """
+    Возвращает множество id авторов, на которых подписан
+    пользователь запроса. Загружается один раз за запрос.
+    """
+    if request is None or request.user.is_anonymous:
+        return frozenset()
+    if not hasattr(request, 'subscriptions'):
+        request.subscriptions = frozenset(
+            request.user.follower.values_list('author_id', flat=True)
+        )
+    return request.subscriptions
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    """ Список, время сериализации которого видно в профиле запроса. """
+
+    def to_representation(self, data):
+        if self.parent is not None:
+            return super().to_representation(data)
+        with timed('serialize'):
+            return super().to_representation(data)
+
+
+class TimedSerializerMixin:
+    """
+    Время сериализации попадает в профиль запроса. Замеряется только
+    корневой сериализатор, для списков в Meta указывается
+    list_serializer_class = TimedListSerializer.
+    """
+
+    def to_representation(self, instance):
+        if self.parent is not None:
+            return super().to_representation(instance)
+        with timed('serialize'):
+            return super().to_representation(instance)
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Картинка рецепта. Отдаёт ссылку на уменьшенную копию, если она
+    уже построена, иначе на оригинал.
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def get_variant(self):
+        if self.variant:
+            return self.variant
+        view = self.context.get('view')
+        if getattr(view, 'action', None) == 'retrieve':
+            return 'full'
+        return 'card'
+
+    def to_internal_value(self, data):
+        with timed('image'):
+            return super().to_internal_value(data)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        path = value.instance.image_variants.get(self.get_variant())
+        if not path:
+            return super().to_representation(value)
+        url = default_storage.url(path)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
 
 class CustomUserCreateSerializer(UserCreateSerializer):
     """Сериализатор создания пользователя."""
@@ -27,11 +105,12 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         return User.objects.create_user(**validated_data)
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     """ Сериализатор для отображения информации о пользователе."""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed', )
@@ -41,38 +120,48 @@ class CustomUserSerializer(UserSerializer):
         Метод для определения, подписан ли пользователь
         на текущего пользователя.
         """
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return user.follower.filter(author=obj).exists()
+        return obj.id in get_subscriptions(self.context.get('request'))
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор просмотра тегов """
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Tag
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор для ингредиентов """
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit', )
 
 
-class RecipeSnippetSerializer(serializers.ModelSerializer):
+class RecipeSnippetSerializer(TimedSerializerMixin,
+                              serializers.ModelSerializer):
     """ Сериализатор отображения избранного """
-    image = Base64ImageField()
+    image = RecipeImageField(variant='thumbnail')
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """ Список id рецептов для пакетных операций. """
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class FollowSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор подписки"""
     email = serializers.ReadOnlyField()
     username = serializers.ReadOnlyField()
@@ -83,31 +172,14 @@ class FollowSerializer(serializers.ModelSerializer):
     recipes_count = serializers.SerializerMethodField()
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
 
-    def validate(self, data):
-        """
-        Метод для проверки валидности данных, введенных при создании подписки.
-        """
-        author_id = self.context.get(
-            'request').parser_context.get('kwargs').get('id')
-        author = get_object_or_404(User, id=author_id)
-        user = self.context.get('request').user
-        if user.follower.filter(author=author_id).exists():
-            raise ValidationError(
-                detail='Такая подписка уже существует',
-                code=status.HTTP_400_BAD_REQUEST,
-            )
-        if user == author:
-            raise ValidationError(
-                detail='Невозможно подписаться на самого себя',
-                code=status.HTTP_400_BAD_REQUEST,
-            )
-        return data
-
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         follower = self.context.get('request').user
         if follower.is_anonymous:
             return False
@@ -117,11 +189,14 @@ class FollowSerializer(serializers.ModelSerializer):
         """
         Метод для получения списка рецептов пользователя.
         """
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[: int(limit)]
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            request = self.context.get('request')
+            limit = request.GET.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit:
+                recipes = recipes[: int(limit)]
         serializer = RecipeSnippetSerializer(
             recipes, many=True, read_only=True
         )
@@ -131,7 +206,7 @@ class FollowSerializer(serializers.ModelSerializer):
         """
         Метод для получения количества рецептов пользователя.
         """
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class ReadIngredientRecipeSerializer(serializers.ModelSerializer):
@@ -146,7 +221,7 @@ class ReadIngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор просмотра рецепта """
     author = CustomUserSerializer(read_only=True, many=False)
     tags = TagSerializer(read_only=False, many=True)
@@ -156,9 +231,10 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField(use_url=True, max_length=None)
+    image = RecipeImageField(use_url=True, max_length=None)
 
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'name', 'image', 'text',
@@ -178,27 +254,48 @@ class RecipeReadSerializer(serializers.ModelSerializer):
         Метод для определения, добавлен ли рецепт в избранное
         текущим пользователем.
         """
+        if hasattr(obj, 'relation_kinds'):
+            return bool(obj.relation_kinds & FavoriteRecipe.KIND)
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
-        return Recipe.objects.filter(
-            favoriterecipe__user=request.user, id=obj.id).exists()
+        return FavoriteRecipe.objects.filter(
+            user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         """
         Метод для определения, добавлен ли рецепт в корзину
         покупок текущим пользователем.
         """
+        if hasattr(obj, 'relation_kinds'):
+            return bool(obj.relation_kinds & ShoppingCart.KIND)
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
-        return Recipe.objects.filter(
-            shoppingcart__user=request.user, id=obj.id).exists()
+        return ShoppingCart.objects.filter(
+            user=request.user, recipe=obj).exists()
+
+
+def get_objects(queryset, ids, message):
+    """
+    Загружает объекты по списку id одним запросом IN и возвращает
+    их в том же порядке. Все ненайденные id перечисляются в ошибке.
+    """
+    objects = queryset.in_bulk(set(ids))
+    missing = sorted(set(ids) - objects.keys())
+    if missing:
+        raise serializers.ValidationError(
+            message.format(', '.join(map(str, missing)))
+        )
+    return [objects[pk] for pk in ids]
 
 
 class CreateIngredientRecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор количества игредиента для рецепта."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    """
+    Сериализатор количества игредиента для рецепта. Ингредиенты по id
+    загружаются всем списком в CreateRecipeSerializer.
+    """
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = RecipeIngredient
@@ -211,11 +308,10 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     ingredients = CreateIngredientRecipeSerializer(
         many=True,
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=Tag.objects.all(),
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
     )
-    image = Base64ImageField(max_length=None)
+    image = RecipeImageField(max_length=None)
     cooking_time = serializers.IntegerField()
 
     class Meta:
@@ -224,37 +320,57 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             'id', 'tags', 'author', 'ingredients',
             'name', 'image', 'text', 'cooking_time',)
 
+    def validate_tags(self, value):
+        """ Загружает все теги одним запросом. """
+        return get_objects(Tag.objects.all(), value, 'Теги не найдены: {}.')
+
+    def validate_ingredients(self, value):
+        """ Загружает все ингредиенты одним запросом. """
+        ingredients = get_objects(
+            Ingredient.objects.all(),
+            [ingredient['id'] for ingredient in value],
+            'Ингредиенты не найдены: {}.',
+        )
+        for item, ingredient in zip(value, ingredients):
+            item['id'] = ingredient
+        return value
+
     def validate(self, data):
         """
         Метод для проверки валидности данных, введенных пользователем.
+        При частичном обновлении проверяются только присланные поля.
         """
-        ingredients = data['ingredients']
-        ingredients_set = set(ingredient['id'] for ingredient in ingredients)
         am_message = 'Количество ингредиента должно быть больше или равно 1.'
         ingredient_message = 'Ингредиенты должны быть уникальными.'
-        if len(ingredients) != len(ingredients_set):
-            raise serializers.ValidationError(
-                {'ingredients': ingredient_message}
+        if 'ingredients' in data:
+            ingredients = data['ingredients']
+            ingredients_set = set(
+                ingredient['id'] for ingredient in ingredients
             )
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            if int(amount) < 1:
+            if len(ingredients) != len(ingredients_set):
                 raise serializers.ValidationError(
-                    {'amount': am_message}
+                    {'ingredients': ingredient_message}
+                )
+            for ingredient in ingredients:
+                amount = ingredient['amount']
+                if int(amount) < 1:
+                    raise serializers.ValidationError(
+                        {'amount': am_message}
+                    )
+
+        if 'tags' in data:
+            if not data['tags']:
+                raise serializers.ValidationError(
+                    {'tags': 'Выберите хотя бы один тэг.'}
+                )
+            tag_set = set(data['tags'])
+            if len(data['tags']) != len(tag_set):
+                raise serializers.ValidationError(
+                    {'tags': 'Тэги должны быть уникальными.'}
                 )
-
-        if not data['tags']:
-            raise serializers.ValidationError(
-                {'tags': 'Выберите хотя бы один тэг.'}
-            )
-        tag_set = set(data['tags'])
-        if len(data['tags']) != len(tag_set):
-            raise serializers.ValidationError(
-                {'tags': 'Тэги должны быть уникальными.'}
-            )
 
         cook_message = 'Время готовки должно быть не меньше одной минуты'
-        if 'cooking_time' not in data or int(data['cooking_time']) <= 0:
+        if 'cooking_time' in data and int(data['cooking_time']) <= 0:
             raise serializers.ValidationError(
                 {'cooking_time': cook_message}
             )
@@ -281,26 +397,86 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(author=request.user, **validated_data)
+        User.objects.filter(pk=request.user.pk).update(
+            recipes_count=F('recipes_count') + 1
+        )
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        FeedEntry.objects.fan_out(recipe)
+        transaction.on_commit(lambda: schedule_variants(recipe))
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Сравнивает присланные ингредиенты с текущими: добавляет новые,
+        обновляет изменившиеся количества, удаляет убранные. Возвращает
+        изменения количеств {id ингредиента: изменение}.
+        """
+        submitted = {
+            ingredient['id'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current, removed, changes = {}, [], {}
+        for row in RecipeIngredient.objects.filter(recipe=recipe):
+            if row.ingredient_id in submitted and (
+                row.ingredient_id not in current
+            ):
+                current[row.ingredient_id] = row
+            else:
+                removed.append(row.pk)
+            changes[row.ingredient_id] = (
+                changes.get(row.ingredient_id, 0) - row.amount
+            )
+        changed = []
+        for pk, row in current.items():
+            if row.amount != submitted[pk]:
+                row.amount = submitted[pk]
+                changed.append(row)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in submitted.items() if pk not in current
+        ])
+        for pk, amount in submitted.items():
+            changes[pk] = changes.get(pk, 0) + amount
+        return changes
+
     @transaction.atomic()
     def update(self, instance, validated_data):
         """
-        Метод для обновления данных рецепта.
+        Метод для обновления данных рецепта. Теги и ингредиенты
+        меняются только там, где они отличаются от текущих.
         """
-        instance.tags.clear()
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        instance.tags.set(validated_data.pop('tags'))
-        ingredients = validated_data.pop('ingredients')
-        self.create_ingredients(instance, ingredients)
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data.pop('tags'))
+        if 'ingredients' in validated_data:
+            changes = self.update_ingredients(
+                instance, validated_data.pop('ingredients')
+            )
+            ShoppingListItem.objects.change_amounts(
+                ShoppingCart.objects.filter(recipe=instance)
+                .values_list('user_id', flat=True),
+                changes,
+            )
+        if 'image' in validated_data:
+            stale = instance.image_variants
+            validated_data['image_variants'] = {}
+            transaction.on_commit(
+                lambda: schedule_variants(instance, stale=stale)
+            )
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
         """
         Метод для преобразования объекта рецепта в словарь.
         """
+        prefetch_related_objects([instance], 'tags', Prefetch(
+            'recipe_ingredients',
+            queryset=RecipeIngredient.objects.select_related('ingredient'),
+        ))
         return RecipeReadSerializer(instance, context={
             'request': self.context.get('request')
         }).data
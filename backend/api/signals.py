@@ -0,0 +1,45 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            Tag)
+from users.models import Follow, User
+
+from .mixins import touch_related
+from .pagination import invalidate_counts
+from .search import ingredient_index
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    """ Сбрасывает индекс автодополнения при изменении ингредиентов. """
+    ingredient_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver((post_save, post_delete), sender=User)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_pagination_counts(**kwargs):
+    """
+    Сбрасывает закешированные количества страниц при записи.
+    Избранное, корзина и подписки удаляются одним DELETE без сигналов,
+    поэтому представления сбрасывают количества сами.
+    """
+    invalidate_counts()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver(post_save, sender=User)
+def invalidate_recipe_validators(update_fields=None, **kwargs):
+    """
+    Сбрасывает ETag и Last-Modified рецептов при изменении тегов,
+    ингредиентов и данных авторов. Вход пользователя (обновление
+    last_login) ответы о рецептах не меняет.
+    """
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    touch_related()
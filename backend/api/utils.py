@@ -1,37 +1,71 @@
+import csv
+import logging
+import os
 from datetime import date
+from functools import lru_cache
 from io import BytesIO
 
+from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest
 from reportlab.lib.pagesizes import landscape, letter
 from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
 from reportlab.pdfgen.canvas import Canvas
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_FONT = 'Helvetica'
+BUNDLED_FONT = (
+    'DejaVuSans', os.path.join(settings.BASE_DIR, 'data', 'DejaVuSans.ttf')
+)
+
+
+@lru_cache(maxsize=None)
+def register_font(fontname: str, fontpath: str) -> str:
+    """
+    Регистрирует TTF-шрифт один раз на процесс. Если файл шрифта
+    недоступен, берется DejaVuSans из data/ с кириллицей. Стандартный
+    Helvetica кириллицы не содержит и используется только без обоих.
+    """
+    for name, path in dict.fromkeys(((fontname, fontpath), BUNDLED_FONT)):
+        try:
+            pdfmetrics.registerFont(TTFont(name, path, 'UTF-8'))
+        except (TTFError, OSError):
+            logger.warning('Шрифт %s не найден', path)
+            continue
+        return name
+    logger.error('Нет шрифта с кириллицей, используется %s: русский текст '
+                 'в PDF будет нечитаем', DEFAULT_FONT)
+    return DEFAULT_FONT
+
 
 class PDFGenerator:
-    def __init__(self, filename: str, fontname: str = 'Bonche-Light',
-                 fontpath: str = 'Bonche-Light.ttf',
+    def __init__(self, filename: str, fontname: str = None,
+                 fontpath: str = None,
                  pagesize: tuple = landscape(letter)):
-        self.buffer = BytesIO()
         self.filename = filename
-        self.fontname = fontname
-        self.fontpath = fontpath
+        self.fontname = register_font(
+            fontname or settings.PDF_FONT_NAME,
+            fontpath or settings.PDF_FONT_PATH,
+        )
         self.pagesize = pagesize
         self.canvas = None
 
-    def _register_font(self):
-        pdfmetrics.registerFont(TTFont(self.fontname, self.fontpath, 'UTF-8'))
-
     def _draw_header(self, text: str, size: int = 20, x: int = 250,
                      y: int = 600):
         self.canvas.setFont(self.fontname, size)
         self.canvas.drawString(x, y, text)
 
-    def _draw_body(self, text_list: list, size: int = 14,
+    def _draw_body(self, text_list, size: int = 14,
                    x: int = 75, y: int = 560,
-                   line_step: int = 20):
+                   line_step: int = 20, bottom: int = 80):
         self.canvas.setFont(self.fontname, size)
+        top = y
         for text in text_list:
+            if y < bottom:
+                self._next_page()
+                self.canvas.setFont(self.fontname, size)
+                y = top
             self.canvas.drawString(x, y, text)
             y -= line_step
 
@@ -40,23 +74,40 @@ class PDFGenerator:
         self.canvas.setFont(self.fontname, size)
         self.canvas.drawString(x, y, text)
 
-    def _create_canvas(self):
-        self.canvas = Canvas(self.buffer, pagesize=self.pagesize)
+    def _finish_page(self):
+        self._draw_footer(
+            f'© FoodGram {date.today().year} — {self.canvas.getPageNumber()}'
+        )
+        self.canvas.showPage()
+
+    def _next_page(self):
+        self._finish_page()
+        self._draw_header('SHOP LIST')
+
+    def _create_canvas(self, output):
+        self.canvas = Canvas(output, pagesize=self.pagesize)
 
     def _close_canvas(self):
-        self.canvas.showPage()
+        self._finish_page()
         self.canvas.save()
+        self.canvas = None
 
-    def generate(self, text_list: list):
-        self._register_font()
-        self._create_canvas()
+    def generate(self, text_list, output=None):
+        """
+        Рисует документ и записывает его в output (файл, ответ).
+        Строки выводятся постранично, text_list может быть генератором.
+        Без output документ записывается в новый BytesIO.
+        """
+        if output is None:
+            output = BytesIO()
+        self._create_canvas(output)
         self._draw_header('SHOP LIST')
         self._draw_body(text_list)
-        self._draw_footer(f'© FoodGram {date.today().year}')
         self._close_canvas()
 
-        self.buffer.seek(0)
-        return self.buffer
+        if isinstance(output, BytesIO):
+            output.seek(0)
+        return output
 
     def download_pdf(self, request):
         shopping_list = request.GET.get('items')
@@ -64,10 +115,39 @@ class PDFGenerator:
             return HttpResponseBadRequest('Parameter <items> is required.')
 
         pdf_generator = PDFGenerator('shopping_list.pdf')
-        pdf_buffer = pdf_generator.generate(shopping_list.split('\n'))
-
-        response = HttpResponse(pdf_buffer.read(),
-                                content_type='application/pdf')
+        response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment;' \
                                           f'filename={pdf_generator.filename}'
+        pdf_generator.generate(shopping_list.split('\n'), response)
         return response
+
+
+class Echo:
+    """ Псевдо-буфер для потоковой записи csv: возвращает строку. """
+
+    def write(self, value):
+        return value
+
+
+def shopping_list_txt(user, ingredients):
+    """ Построчно выдает список покупок в текстовом виде. """
+    yield f'Cписок покупок пользователя:\n {user.first_name}'
+    for name, unit, amount in ingredients:
+        yield f'\n-- {name} - {amount} в ({unit})'
+
+
+def shopping_list_csv(ingredients):
+    """ Построчно выдает список покупок в формате csv. """
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in ingredients:
+        yield writer.writerow(row)
+
+
+def shopping_list_pdf(ingredients, output):
+    """ Записывает pdf-файл списка покупок в output. """
+    return PDFGenerator('Shopping_Cart_list.pdf').generate(
+        (f'-- {name} - {amount} ({unit})'
+         for name, unit, amount in ingredients),
+        output,
+    )
@@ -1,35 +1,55 @@
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, F, IntegerField, OuterRef,
+                              Prefetch, Subquery, Sum, Value, Window,
+                              prefetch_related_objects)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingCart, Tag)
+from recipes.models import (FavoriteRecipe, FeedEntry, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag, UserRecipe)
 from users.models import Follow, User
 
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .mixins import (ConditionalGetMixin, make_etag, related_modified,
+                     related_version)
+from .pagination import CustomPagination, FeedPagination, invalidate_counts
 from .permissions import AuthorPermission
+from .profiling import timed
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
+from .search import ingredient_index
 from .serializers import (CreateRecipeSerializer, CustomUserSerializer,
                           FollowSerializer, IngredientSerializer,
-                          RecipeReadSerializer, RecipeSnippetSerializer,
-                          TagSerializer)
+                          RecipeIdsSerializer, RecipeReadSerializer,
+                          RecipeSnippetSerializer, TagSerializer,
+                          get_subscriptions)
+from .utils import shopping_list_csv, shopping_list_pdf, shopping_list_txt
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """ Отображение вывода тегов """
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny, )
     # pagination_class = None
 
+    def get_etag(self, request):
+        return make_etag(
+            self.kwargs.get('pk'), list(Tag.objects.values_list())
+        )
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Отображение вывода ингредиентов """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -38,19 +58,100 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (IngredientFilter, )
     search_fields = ('^name', )
 
+    def get_etag(self, request):
+        return make_etag(
+            self.kwargs.get('pk'),
+            sorted(request.query_params.lists()),
+            related_version(),
+            ingredient_index.digest,
+        )
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """ Вывод работы с рецептами """
     queryset = Recipe.objects.all()
     permission_classes = (AuthorPermission, )
     filterset_class = RecipeFilter
     pagination_class = CustomPagination
+    keyset_ordering = ('-pub_date', '-id')
     serializer_class = CreateRecipeSerializer
     filter_backends = (DjangoFilterBackend, )
 
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
 
+    def get_queryset(self):
+        """
+        Возвращает рецепты с флагами избранного и корзины текущего
+        пользователя и заранее загруженными связями.
+        """
+        user = self.request.user
+        queryset = Recipe.objects.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ),
+        )
+        if user.is_anonymous:
+            return queryset.annotate(
+                relation_kinds=Value(0, output_field=IntegerField())
+            )
+        return queryset.annotate(relation_kinds=Coalesce(Subquery(
+            UserRecipe.objects.filter(user=user, recipe=OuterRef('pk'))
+            .order_by().values('recipe')
+            .annotate(kinds=Sum('kind')).values('kinds')
+        ), 0))
+
+    @transaction.atomic()
+    def perform_destroy(self, instance):
+        """
+        Удаляет рецепт и вычитает его из списков покупок пользователей.
+        """
+        ShoppingListItem.objects.add_recipes(
+            ShoppingCart.objects.filter(recipe=instance)
+            .values_list('user_id', flat=True),
+            [instance.pk], sign=-1,
+        )
+        User.objects.filter(
+            pk=instance.author_id, recipes_count__gt=0
+        ).update(recipes_count=F('recipes_count') - 1)
+        instance.delete()
+
+    def get_validators(self):
+        """
+        Возвращает дату изменения рецепта и флаги пользователя
+        одним запросом, без загрузки связей и сериализации.
+        """
+        if not hasattr(self, '_validators'):
+            self._validators = None
+            if self.action == 'retrieve' and self.kwargs['pk'].isdigit():
+                self._validators = (
+                    self.get_queryset().prefetch_related(None)
+                    .filter(pk=self.kwargs['pk'])
+                    .values_list('updated_at', 'author_id', 'relation_kinds')
+                    .first()
+                )
+        return self._validators
+
+    def get_etag(self, request):
+        validators = self.get_validators()
+        if validators is None:
+            return None
+        updated_at, author_id, relation_kinds = validators
+        return make_etag(
+            updated_at, related_version(), request.user.id, relation_kinds,
+            author_id in get_subscriptions(request),
+        )
+
+    def get_last_modified(self, request):
+        validators = self.get_validators()
+        if validators is None or request.user.is_authenticated:
+            return None
+        return max(validators[0], related_modified())
+
     def get_serializer_class(self):
         """
         Возвращает класс сериализатора, соответствующий типу запроса.
@@ -65,12 +166,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """
            Добавляет рецепт в список избранных для текущего пользователя.
         """
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == "POST":
-            favorite, created = FavoriteRecipe.objects.get_or_create(
-                user=request.user, recipe=recipe
-            )
+            recipe = get_object_or_404(Recipe, id=pk)
+            with transaction.atomic():
+                created = FavoriteRecipe.objects.add(
+                    user=request.user, recipe=recipe
+                )
+                if created:
+                    Recipe.objects.filter(pk=recipe.pk).update(
+                        favorites_count=F('favorites_count') + 1
+                    )
             if created:
+                invalidate_counts()
                 serializer = RecipeSnippetSerializer(recipe)
                 return Response(serializer.data,
                                 status=status.HTTP_201_CREATED)
@@ -78,11 +185,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
                             status.HTTP_400_BAD_REQUEST
                             )
 
-        favorite_recipe = FavoriteRecipe.objects.filter(
-            user=request.user, recipe=recipe
-        )
-        if favorite_recipe.exists():
-            favorite_recipe.delete()
+        with transaction.atomic():
+            removed = FavoriteRecipe.objects.discard(
+                user=request.user, recipe_id=pk
+            )
+            if removed:
+                Recipe.objects.filter(
+                    pk=pk, favorites_count__gt=0
+                ).update(favorites_count=F('favorites_count') - 1)
+        if removed:
+            invalidate_counts()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'detail': 'Запись не в избранном'},
                         status.HTTP_400_BAD_REQUEST
@@ -96,12 +208,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
         добавленных в корзину пользователя
         с идентификатором pk.
         """
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == "POST":
-            shop, created = ShoppingCart.objects.get_or_create(
-                user=request.user, recipe=recipe
-            )
+            recipe = get_object_or_404(Recipe, id=pk)
+            with transaction.atomic():
+                created = ShoppingCart.objects.add(
+                    user=request.user, recipe=recipe
+                )
+                if created:
+                    ShoppingListItem.objects.add_recipes(
+                        [request.user.id], [recipe.pk]
+                    )
             if created:
+                invalidate_counts()
                 serializer = RecipeSnippetSerializer(recipe)
                 return Response(serializer.data,
                                 status=status.HTTP_201_CREATED)
@@ -109,45 +227,149 @@ class RecipeViewSet(viewsets.ModelViewSet):
                             status.HTTP_400_BAD_REQUEST
                             )
 
-        shopping_cart = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe
-        )
-        if shopping_cart.exists():
-            shopping_cart.delete()
+        with transaction.atomic():
+            removed = ShoppingCart.objects.discard(
+                user=request.user, recipe_id=pk
+            )
+            if removed:
+                ShoppingListItem.objects.add_recipes(
+                    [request.user.id], [pk], sign=-1
+                )
+        if removed:
+            invalidate_counts()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'detail': 'Запись нет в корзине'},
                         status.HTTP_400_BAD_REQUEST
                         )
 
-    @action(methods=['GET'], detail=False,
+    def toggle_batch(self, request, model):
+        """
+        Добавляет (POST) или убирает (DELETE) сразу несколько рецептов
+        в избранное или корзину и возвращает результат по каждому id.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        found = set(
+            Recipe.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        user = request.user
+        # Счетчики и списки покупок меняются только по строкам, которые
+        # вставил или удалил сам запрос: параллельный запрос с теми же
+        # рецептами их уже не получит.
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = set(model.objects.add_recipes(
+                    user.id, [pk for pk in ids if pk in found]
+                ))
+                sign, done, skipped = 1, 'added', 'exists'
+            else:
+                changed = set(model.objects.discard_recipes(
+                    user.id, [pk for pk in ids if pk in found]
+                ))
+                sign, done, skipped = -1, 'removed', 'absent'
+            if changed and model is FavoriteRecipe:
+                recipes = Recipe.objects.filter(pk__in=changed)
+                if sign < 0:
+                    recipes = recipes.filter(favorites_count__gt=0)
+                recipes.update(favorites_count=F('favorites_count') + sign)
+            elif changed:
+                ShoppingListItem.objects.add_recipes([user.id], changed, sign)
+        if changed:
+            invalidate_counts()
+        return Response({'results': [
+            {'id': pk,
+             'status': (done if pk in changed
+                        else skipped if pk in found else 'not_found')}
+            for pk in ids
+        ]})
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='favorite', permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        """
+        Добавляет в избранное или убирает из него
+        рецепты из списка recipes.
+        """
+        return self.toggle_batch(request, FavoriteRecipe)
+
+    @action(methods=['post', 'delete'], detail=False,
+            url_path='shopping_cart', permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        """
+        Добавляет в корзину или убирает из нее
+        рецепты из списка recipes.
+        """
+        return self.toggle_batch(request, ShoppingCart)
+
+    @action(methods=['delete'], detail=False,
+            url_path='shopping_cart/clear',
             permission_classes=[IsAuthenticated])
+    def clear_shopping_cart(self, request):
+        """
+        Очищает корзину и список покупок пользователя.
+        """
+        with transaction.atomic():
+            deleted, _ = ShoppingCart.objects.filter(
+                user=request.user
+            ).delete()
+            ShoppingListItem.objects.filter(user=request.user).delete()
+        if deleted:
+            invalidate_counts()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        """
+        paginator = FeedPagination()
+        entries = paginator.paginate_queryset(
+            FeedEntry.objects.filter(user=request.user), request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries]
+        )
+        serializer = RecipeReadSerializer(
+            [recipes[entry.recipe_id] for entry in entries
+             if entry.recipe_id in recipes],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['GET'], detail=False,
+            permission_classes=[IsAuthenticated],
+            renderer_classes=(PlainTextRenderer, CSVRenderer, PDFRenderer))
     def download_shopping_cart(self, request):
         """
         Список ингредиентов
         для рецептов из корзины пользователя.
+        Формат файла задается параметром format: txt, csv или pdf.
         """
         ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__shoppingcart__user=request.user)
-            .values('ingredient__name',
-                    'ingredient__measurement_unit', 'amount')
+            ShoppingListItem.objects
+            .filter(user=request.user)
+            .values_list('ingredient__name', 'ingredient__measurement_unit',
+                         'amount')
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
         )
-        goods = {}
-        for good in ingredients:
-            name = good.get('ingredient__name')
-            unit = good.get('ingredient__measurement_unit')
-            amount = good.get('amount')
-            key = f'{name}|{unit}'
-            if key in goods.keys():
-                goods[key] += amount
-            else:
-                goods[key] = amount
-        text = [f'Cписок покупок пользователя:\n {request.user.first_name}']
-        for name_and_unit, amount in goods.items():
-            name, unit = name_and_unit.split('|')
-            text.append(f'\n-- {name} - {amount} в ({unit})')
-        filename = "Shopping_Cart_list.txt"
-        response = HttpResponse(text, content_type='text/plain')
+        file_format = request.accepted_renderer.format
+        filename = f'Shopping_Cart_list.{file_format}'
+        if file_format == 'pdf':
+            response = HttpResponse(content_type='application/pdf')
+            with timed('pdf'):
+                shopping_list_pdf(ingredients.iterator(), response)
+        elif file_format == 'csv':
+            response = StreamingHttpResponse(
+                shopping_list_csv(ingredients.iterator()),
+                content_type='text/csv',
+            )
+        else:
+            response = StreamingHttpResponse(
+                shopping_list_txt(request.user, ingredients.iterator()),
+                content_type='text/plain',
+            )
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
@@ -160,6 +382,7 @@ class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     pagination_class = CustomPagination
+    keyset_ordering = ('username', 'id')
 
     @action(
         detail=True,
@@ -175,24 +398,65 @@ class CustomUserViewSet(UserViewSet):
         если метод DELETE.
         """
         user = request.user
-        author = get_object_or_404(User, pk=id)
 
         if request.method == 'POST':
-            serializer = FollowSerializer(
-                author, data=request.data, context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            if Follow.objects.filter(user=user, author=author).exists():
+            author = get_object_or_404(User, pk=id)
+            if user == author:
+                return Response(
+                    'Невозможно подписаться на самого себя',
+                    status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                created = Follow.objects.add(user=user, author=author)
+                if created:
+                    User.objects.filter(pk=author.pk).update(
+                        followers_count=F('followers_count') + 1
+                    )
+                    FeedEntry.objects.backfill(user, author)
+            if not created:
                 return Response(
                     "Вы уже подписаны", status=status.HTTP_400_BAD_REQUEST)
-            Follow.objects.create(user=user, author=author)
+            invalidate_counts()
+            author.is_subscribed = True
+            serializer = FollowSerializer(
+                author, context={'request': request}
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        if request.method == 'DELETE':
-            get_object_or_404(
-                Follow, user=user, author=author
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            removed = Follow.objects.discard(user=user, author_id=id)
+            if removed:
+                User.objects.filter(
+                    pk=id, followers_count__gt=0
+                ).update(followers_count=F('followers_count') - 1)
+                FeedEntry.objects.prune(user, id)
+        if not removed:
+            raise NotFound('Подписка не найдена.')
+        invalidate_counts()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_recipes_preview(self, authors, limit):
+        """
+        Возвращает первые limit рецептов каждого автора одним запросом
+        с нумерацией рецептов внутри автора оконной функцией.
+        """
+        queryset = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time', 'author'
+        )
+        if not limit or not limit.isdigit():
+            return queryset
+        ranked = Recipe.objects.filter(author__in=authors).annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        ).order_by().values('id', 'recipe_rank')
+        sql, params = ranked.query.sql_with_params()
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s',
+            (*params, int(limit)),
+        ))
 
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
@@ -201,8 +465,16 @@ class CustomUserViewSet(UserViewSet):
         на которых подписан пользователь request.user.
         """
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        queryset = User.objects.filter(following__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        )
         pages = self.paginate_queryset(queryset)
+        limit = request.query_params.get('recipes_limit')
+        prefetch_related_objects(pages, Prefetch(
+            'recipes',
+            queryset=self.get_recipes_preview(pages, limit),
+            to_attr='recipes_preview',
+        ))
         serializer = FollowSerializer(
             pages, many=True, context={'request': request}
         )
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'users.apps.UsersConfig',
     'recipes.apps.RecipesConfig',
     'api.apps.ApiConfig',
@@ -36,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +89,43 @@ else:
         }
     }
 
+# Кэши общие для всех процессов: воркеров gunicorn и команд manage.py,
+# поэтому кэш в памяти одного процесса не подходит. Часто меняющиеся
+# количества пагинации лежат в отдельном кэше counts, и их вытеснение
+# не задевает служебные ключи в control (переключатель профилирования,
+# версии количеств и связанных с рецептами данных): там единицы
+# записей, и до вытеснения по MAX_ENTRIES дело не доходит.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'
+)
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'foodgram-cache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION', os.path.join(CACHE_DIR, 'default')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'counts': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'COUNT_CACHE_LOCATION', os.path.join(CACHE_DIR, 'counts')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('COUNT_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'control': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'CONTROL_CACHE_LOCATION', os.path.join(CACHE_DIR, 'control')
+        ),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -107,6 +148,10 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 USE_I18N = True
@@ -130,6 +175,57 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 LENGTH_FIELD_RECIPES = 200
 
+# Картинки рецептов: пул фоновой обработки и формат уменьшенных копий
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', 'WEBP').upper()
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', 80))
+
+# Пагинация
+PAGINATION_COUNT_TTL = int(os.getenv('PAGINATION_COUNT_TTL', 30))
+PAGINATION_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_ESTIMATE_THRESHOLD', 10000)
+)
+
+# Автодополнение ингредиентов
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Профилирование запросов: заголовок Server-Timing и лог медленных
+# запросов. Переключается на ходу командой manage.py profiling.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in (
+    '1', 'true', 'yes'
+)
+PROFILING_SLOW_MS = int(os.getenv('PROFILING_SLOW_MS', 500))
+PROFILING_SWITCH_TTL = int(os.getenv('PROFILING_SWITCH_TTL', 5))
+
+# Метрики запросов для локального сборщика (/metrics). Воркеры gunicorn
+# складывают метрики в общий каталог METRICS_DIR.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in (
+    '1', 'true', 'yes'
+)
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+METRICS_ALLOWED_IPS = os.getenv(
+    'METRICS_ALLOWED_IPS', '127.0.0.1,::1'
+).split(',')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.profiling': {'handlers': ['console'], 'level': 'WARNING'},
+    },
+}
+
+# PDF
+PDF_FONT_NAME = os.getenv('PDF_FONT_NAME', 'DejaVuSans')
+PDF_FONT_PATH = os.getenv(
+    'PDF_FONT_PATH', os.path.join(BASE_DIR, 'data', 'DejaVuSans.ttf')
+)
+
 DJOSER = {
     "SERIALIZERS": {
         "user_create": "api.serializers.UserCreateSerializer",
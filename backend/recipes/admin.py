@@ -10,14 +10,16 @@ User = get_user_model()
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     min_num = 1
+    autocomplete_fields = ('ingredient', )
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     """ Панель администратора управление  ингредиентами """
     list_display = ('name', 'measurement_unit', )
-    list_filter = ('name', )
+    list_filter = ('measurement_unit', )
     search_fields = ('name',)
+    ordering = ('name', )
     empty_value_display = '-пусто-'
 
 
@@ -33,27 +35,36 @@ class RecipeAdmin(admin.ModelAdmin):
     """ Панель администратора упправление рецептами """
     inlines = [RecipeIngredientInline, ]
     list_display = ('name', 'author', 'favorites',)
-    list_filter = ('author', 'name', 'tags',)
-    search_fields = ('text', )
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username', 'author__email', )
+    autocomplete_fields = ('author', )
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
+    @admin.display(description='В избранном', ordering='favorites_count')
     def favorites(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
 
 @admin.register(RecipeIngredient)
 class RecipeIngredientAdmin(admin.ModelAdmin):
     """ Панель администратора управление ингредиентами рецепта """
     list_display = ('recipe', 'ingredient', 'amount', )
-    list_filter = ('recipe',)
+    list_select_related = ('recipe', 'ingredient', )
+    search_fields = ('recipe__name', 'ingredient__name', )
+    autocomplete_fields = ('recipe', 'ingredient', )
+    show_full_result_count = False
 
 
 @admin.register(FavoriteRecipe)
 class FavoriteRecipesAdmin(admin.ModelAdmin):
     """ Панель администратора избранные рецепты """
     list_display = ('recipe', 'user')
-    list_filter = ('recipe', 'user')
-    search_fields = ('user',)
+    list_select_related = ('recipe', 'user', )
+    search_fields = ('user__username', 'user__email', 'recipe__name', )
+    autocomplete_fields = ('recipe', 'user', )
+    show_full_result_count = False
     empty_value_display = '-пусто-'
 
 
@@ -61,6 +72,8 @@ class FavoriteRecipesAdmin(admin.ModelAdmin):
 class ShopListAdmin(admin.ModelAdmin):
     """ Панель администратора списка покупок """
     list_display = ('user', 'recipe', )
-    list_filter = ('user', )
-    search_fields = ('user',)
+    list_select_related = ('user', 'recipe', )
+    search_fields = ('user__username', 'user__email', 'recipe__name', )
+    autocomplete_fields = ('user', 'recipe', )
+    show_full_result_count = False
     empty_value_display = '-пусто-'
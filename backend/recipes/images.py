@@ -0,0 +1,123 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumbnail': (320, 320),
+    'card': (640, 640),
+    'full': (1280, 1280),
+}
+
+
+def variant_format():
+    """ Формат вариантов: WebP, если Pillow собран с его поддержкой. """
+    if settings.IMAGE_VARIANT_FORMAT == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return settings.IMAGE_VARIANT_FORMAT
+
+
+def variant_name(name, variant, image_format):
+    """ Путь варианта рядом с оригиналом: variants/<имя>_<вариант>.<ext>. """
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    return os.path.join(directory, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def render_variants(name):
+    """
+    Декодирует оригинал один раз и сохраняет уменьшенные копии.
+    Возвращает словарь {вариант: путь в хранилище}.
+    """
+    image_format = variant_format()
+    with default_storage.open(name) as source:
+        original = Image.open(source)
+        original.load()
+    if image_format == 'JPEG' or original.mode not in ('RGB', 'RGBA'):
+        original = original.convert(
+            'RGB' if image_format == 'JPEG' else 'RGBA'
+        )
+    variants = {}
+    for variant, size in VARIANTS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(
+            buffer, image_format, quality=settings.IMAGE_VARIANT_QUALITY
+        )
+        path = variant_name(name, variant, image_format)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        variants[variant] = default_storage.save(
+            path, ContentFile(buffer.getvalue())
+        )
+    return variants
+
+
+def delete_variants(paths):
+    """ Удаляет файлы устаревших вариантов. """
+    for path in paths:
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+def process_recipe_image(recipe_id, name, stale=None):
+    """
+    Задача пула: строит варианты и записывает их в рецепт, если
+    картинка рецепта за это время не поменялась. Дата изменения
+    рецепта обновляется, чтобы сменились его ETag и Last-Modified.
+    """
+    from .models import Recipe
+
+    close_old_connections()
+    try:
+        variants = render_variants(name)
+        updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants, updated_at=timezone.now()
+        )
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+        return None
+    finally:
+        close_old_connections()
+    if not updated:
+        delete_variants(variants.values())
+    if stale:
+        delete_variants(set(stale.values()) - set(variants.values()))
+    return variants
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    """ Пул потоков обработки картинок, создаётся при первом обращении. """
+    return ThreadPoolExecutor(
+        max_workers=settings.IMAGE_WORKERS,
+        thread_name_prefix='recipe-images',
+    )
+
+
+def wait_for_variants():
+    """ Дожидается обработки всех поставленных в пул картинок. """
+    if get_executor.cache_info().currsize:
+        get_executor().shutdown(wait=True)
+        get_executor.cache_clear()
+
+
+def schedule_variants(recipe, stale=None):
+    """ Ставит построение вариантов картинки рецепта в пул. """
+    if not settings.IMAGE_WORKERS:
+        return process_recipe_image(recipe.pk, recipe.image.name, stale)
+    return get_executor().submit(
+        process_recipe_image, recipe.pk, recipe.image.name, stale
+    )
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.16 on 2026-10-17 07:32
+
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicates(model):
+    first = (
+        model.objects.values('user', 'recipe')
+        .annotate(first=Min('id')).values('first')
+    )
+    deleted, _ = model.objects.exclude(id__in=first).delete()
+    return deleted
+
+
+def deduplicate(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    if remove_duplicates(FavoriteRecipe):
+        Recipe.objects.update(favorites_count=Coalesce(Subquery(
+            FavoriteRecipe.objects.filter(recipe=OuterRef('pk'))
+            .order_by().values('recipe')
+            .annotate(total=Count('pk')).values('total')
+        ), 0))
+    if remove_duplicates(ShoppingCart):
+        ShoppingListItem.objects.all().delete()
+        totals = (
+            RecipeIngredient.objects
+            .filter(recipe__shoppingcart__isnull=False)
+            .values_list('recipe__shoppingcart__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                              amount=amount)
+             for user_id, ingredient_id, amount in totals.iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favoriterecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorite_recipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
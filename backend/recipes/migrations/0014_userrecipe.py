@@ -0,0 +1,103 @@
+# Generated by Django 3.2.16 on 2026-10-17 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+FAVORITE, SHOPPING_CART = 1, 2
+
+
+def copy_relations(apps, schema_editor):
+    UserRecipe = apps.get_model('recipes', 'UserRecipe')
+    for name, kind in (('FavoriteRecipe', FAVORITE),
+                       ('ShoppingCart', SHOPPING_CART)):
+        model = apps.get_model('recipes', name)
+        UserRecipe.objects.bulk_create(
+            (UserRecipe(user_id=user_id, recipe_id=recipe_id, kind=kind)
+             for user_id, recipe_id
+             in model.objects.values_list('user_id', 'recipe_id').iterator()),
+            batch_size=1000,
+        )
+
+
+def split_relations(apps, schema_editor):
+    UserRecipe = apps.get_model('recipes', 'UserRecipe')
+    for name, kind in (('FavoriteRecipe', FAVORITE),
+                       ('ShoppingCart', SHOPPING_CART)):
+        model = apps.get_model('recipes', name)
+        model.objects.bulk_create(
+            (model(user_id=user_id, recipe_id=recipe_id)
+             for user_id, recipe_id
+             in UserRecipe.objects.filter(kind=kind)
+             .values_list('user_id', 'recipe_id').iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_unique_user_recipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Избранное'), (2, 'Корзина')], editable=False, verbose_name='Вид связи')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_relations', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipe_relations', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Рецепт пользователя',
+                'verbose_name_plural': 'Рецепты пользователей',
+            },
+        ),
+        migrations.RunPython(copy_relations, split_relations),
+        migrations.DeleteModel(
+            name='FavoriteRecipe',
+        ),
+        migrations.DeleteModel(
+            name='ShoppingCart',
+        ),
+        migrations.AddIndex(
+            model_name='userrecipe',
+            index=models.Index(condition=models.Q(('kind', 1)), fields=['recipe'], name='user_recipe_favorite_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userrecipe',
+            index=models.Index(condition=models.Q(('kind', 2)), fields=['recipe', 'user'], name='user_recipe_cart_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='userrecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'kind', 'recipe'), name='unique_user_recipe'),
+        ),
+        migrations.CreateModel(
+            name='FavoriteRecipe',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Избранный рецепт',
+                'verbose_name_plural': 'Избранное',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('recipes.userrecipe',),
+        ),
+        migrations.CreateModel(
+            name='ShoppingCart',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Рецепт в корзине',
+                'verbose_name_plural': 'Корзины',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('recipes.userrecipe',),
+        ),
+    ]
@@ -1,9 +1,11 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import connections, models
+from django.db.models import Case, F, Q, Sum, Value, When
 
-from users.models import User
+from users.models import Follow, RelationManager, User
 
 
 class Tag(models.Model):
@@ -83,6 +85,12 @@ class Recipe(models.Model):
         verbose_name='Картинка',
         blank=False,
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Теги'
@@ -110,6 +118,21 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
@@ -120,44 +143,145 @@ class Recipe(models.Model):
         return self.name
 
 
-# class UserRecipe(models.Model):
-#     """Абстрактная модель списка рецептов пользователя."""
-#     user = models.ForeignKey(
-#         User,
-#         on_delete=models.CASCADE,
-#         verbose_name='Пользователь',
+class UserRecipeManager(RelationManager):
+    """ Связи пользователя с рецептами одного вида. """
+
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+
+    def get_queryset(self):
+        return super().get_queryset().filter(kind=self.kind)
+
+    def add_recipes(self, user_id, recipe_ids):
+        """
+        Добавляет связи с рецептами и возвращает id тех, строки которых
+        действительно вставлены: на PostgreSQL одним INSERT ... ON
+        CONFLICT DO NOTHING RETURNING, иначе по одному INSERT на рецепт.
+        """
+        recipe_ids = list(recipe_ids)
+        connection = connections[self.db]
+        if not recipe_ids:
+            return []
+        if connection.vendor != 'postgresql':
+            return [pk for pk in recipe_ids
+                    if self.add(user_id=user_id, recipe_id=pk)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                '(user_id, recipe_id, kind) '
+                'SELECT %s, recipe_id, %s FROM unnest(%s) AS recipe_id '
+                'ON CONFLICT DO NOTHING RETURNING recipe_id',
+                [user_id, self.kind, recipe_ids],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def discard_recipes(self, user_id, recipe_ids):
+        """
+        Удаляет связи с рецептами и возвращает id тех, строки которых
+        действительно удалены: на PostgreSQL одним DELETE ... RETURNING,
+        иначе по одному DELETE на рецепт.
+        """
+        recipe_ids = list(recipe_ids)
+        connection = connections[self.db]
+        if not recipe_ids:
+            return []
+        if connection.vendor != 'postgresql':
+            return [pk for pk in recipe_ids
+                    if self.discard(user_id=user_id, recipe_id=pk)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} '
+                'WHERE user_id = %s AND kind = %s '
+                'AND recipe_id = ANY(%s) RETURNING recipe_id',
+                [user_id, self.kind, recipe_ids],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class UserRecipe(models.Model):
+    """ Связь пользователя с рецептом: избранное или корзина. """
+
+    class Kind(models.IntegerChoices):
+        # Значения - биты, чтобы сумма видов давала маску флагов рецепта.
+        FAVORITE = 1, 'Избранное'
+        SHOPPING_CART = 2, 'Корзина'
+
+    KIND = None
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recipe_relations',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='user_relations',
+        verbose_name='Рецепт',
+    )
+    kind = models.PositiveSmallIntegerField(
+        verbose_name='Вид связи',
+        choices=Kind.choices,
+        editable=False,
+    )
+
+    objects = RelationManager()
 
-#     )
-#     recipe = models.ForeignKey(
-#         Recipe,
-#         on_delete=models.CASCADE,
-#         verbose_name='Рецепт',
-#     )
+    class Meta:
+        verbose_name = 'Рецепт пользователя'
+        verbose_name_plural = 'Рецепты пользователей'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'kind', 'recipe'),
+                name='unique_user_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('recipe',),
+                name='user_recipe_favorite_idx',
+                condition=Q(kind=1),
+            ),
+            models.Index(
+                fields=('recipe', 'user'),
+                name='user_recipe_cart_idx',
+                condition=Q(kind=2),
+            ),
+        ]
 
-#     class Meta:
-#         abstract = True
-#         constraints = [
-#             UniqueConstraint(
-#                 fields=('user', 'recipe'),
-#                 name='%(app_label)s_%(class)s_unique'
-#             )
-#         ]
+    def __init__(self, *args, **kwargs):
+        if not args and self.KIND is not None:
+            kwargs.setdefault('kind', self.KIND)
+        super().__init__(*args, **kwargs)
 
-#     def __str__(self):
-#         return f'{self.user} :: {self.recipe}'
+    def __str__(self):
+        return f'{self.user} :: {self.recipe}'
 
 
-class FavoriteRecipe(models.Model):
+class FavoriteRecipe(UserRecipe):
     """ Модель добавление в избраное. """
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    KIND = UserRecipe.Kind.FAVORITE
+
+    objects = UserRecipeManager(KIND)
+
+    class Meta:
+        proxy = True
+        verbose_name = 'Избранный рецепт'
+        verbose_name_plural = 'Избранное'
 
 
-class ShoppingCart(models.Model):
+class ShoppingCart(UserRecipe):
     """ Модель рецепта для списка покупок пользователя."""
+    KIND = UserRecipe.Kind.SHOPPING_CART
+
+    objects = UserRecipeManager(KIND)
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    class Meta:
+        proxy = True
+        verbose_name = 'Рецепт в корзине'
+        verbose_name_plural = 'Корзины'
 
 
 class RecipeIngredient(models.Model):
@@ -191,3 +315,177 @@ class RecipeIngredient(models.Model):
             f'{self.ingredient.name} – {self.amount} '
             f'{self.ingredient.measurement_unit}'
         )
+
+
+class ShoppingListManager(models.Manager):
+    """ Поддерживает сводный список покупок в актуальном состоянии. """
+
+    def change_amounts(self, user_ids, amounts):
+        """
+        Прибавляет к спискам покупок пользователей user_ids
+        изменения количества ингредиентов {id ингредиента: изменение}.
+        Строки с нулевым количеством удаляются, если что-то вычиталось.
+        """
+        user_ids = list(user_ids)
+        amounts = {pk: value for pk, value in amounts.items() if value}
+        if not user_ids or not amounts:
+            return
+        self.bulk_create(
+            [self.model(user_id=user_id, ingredient_id=pk, amount=0)
+             for user_id in user_ids
+             for pk, value in amounts.items() if value > 0],
+            ignore_conflicts=True,
+        )
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        items.update(amount=F('amount') + Case(
+            *(When(ingredient_id=pk, then=Value(value))
+              for pk, value in amounts.items()),
+            default=Value(0),
+            output_field=models.IntegerField(),
+        ))
+        if any(value < 0 for value in amounts.values()):
+            items.filter(amount__lte=0).delete()
+
+    def live_amounts(self):
+        """
+        Рассчитывает список покупок заново по корзинам пользователей:
+        (id пользователя, id ингредиента, количество).
+        """
+        return (
+            RecipeIngredient.objects
+            .filter(recipe__user_relations__kind=ShoppingCart.KIND)
+            .values_list('recipe__user_relations__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+
+    def rebuild(self, batch_size=1000):
+        """ Пересоздает сводные списки покупок всех пользователей. """
+        self.all().delete()
+        self.bulk_create(
+            (self.model(user_id=user_id, ingredient_id=ingredient_id,
+                        amount=amount)
+             for user_id, ingredient_id, amount
+             in self.live_amounts().iterator()),
+            batch_size=batch_size,
+        )
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        """
+        Добавляет (sign=1) или вычитает (sign=-1) ингредиенты
+        рецептов recipe_ids одним обновлением списков покупок.
+        """
+        amounts = (
+            RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .values_list('ingredient_id')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+        self.change_amounts(user_ids, {
+            pk: sign * total for pk, total in amounts
+        })
+
+
+class ShoppingListItem(models.Model):
+    """
+    Сводный список покупок: суммарное количество ингредиента
+    по всем рецептам из корзины пользователя.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(verbose_name='Количество ингредиента')
+
+    objects = ShoppingListManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} – {self.amount}'
+
+
+class FeedManager(models.Manager):
+    """ Заполняет ленты подписчиков при публикации и подписке. """
+
+    def fan_out(self, recipe, batch_size=1000):
+        """ Добавляет рецепт в ленты всех подписчиков автора. """
+        followers = Follow.objects.filter(
+            author=recipe.author_id
+        ).values_list('user_id', flat=True)
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe=recipe,
+                        pub_date=recipe.pub_date)
+             for user_id in followers.iterator()),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def backfill(self, user, author, batch_size=1000):
+        """ Добавляет в ленту пользователя рецепты нового автора. """
+        recipes = Recipe.objects.filter(
+            author=author
+        ).values_list('id', 'pub_date')
+        self.bulk_create(
+            (self.model(user=user, recipe_id=recipe_id, pub_date=pub_date)
+             for recipe_id, pub_date in recipes.iterator()),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def prune(self, user, author):
+        """ Удаляет из ленты пользователя рецепты автора. """
+        self.filter(user=user, recipe__author=author).delete()
+
+
+class FeedEntry(models.Model):
+    """ Лента подписок: рецепт автора в ленте подписчика. """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = FeedManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
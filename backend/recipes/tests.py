@@ -0,0 +1,85 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag)
+from users.models import User
+
+CHANGELISTS = (
+    'admin:recipes_recipe_changelist',
+    'admin:recipes_favoriterecipe_changelist',
+    'admin:recipes_shoppingcart_changelist',
+    'admin:recipes_recipeingredient_changelist',
+)
+
+
+class AdminChangelistQueriesTest(TestCase):
+    """
+    Число запросов страниц списков в админке не зависит
+    от количества строк в таблице.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', password='admin',
+            first_name='Админ', last_name='Админов',
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#49B64E', slug='lunch'
+        )
+        Ingredient.objects.bulk_create([
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(5)
+        ])
+        cls.ingredients = list(Ingredient.objects.all())
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.created = 0
+
+    def add_rows(self, count):
+        """ Добавляет count авторов с рецептом, избранным и корзиной. """
+        for number in range(self.created, self.created + count):
+            user = User.objects.create_user(
+                email=f'user{number}@example.com',
+                username=f'user{number}', password='password',
+                first_name='Имя', last_name='Фамилия',
+            )
+            recipe = Recipe.objects.create(
+                author=user, name=f'Рецепт {number}', text='Описание',
+                image='recipes/image/test.png', cooking_time=10,
+            )
+            recipe.tags.add(self.tag)
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+                for ingredient in self.ingredients
+            ])
+            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.created += count
+
+    def changelist_queries(self, name):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_rows(3)
+        expected = {
+            name: self.changelist_queries(name) for name in CHANGELISTS
+        }
+        self.add_rows(30)
+        for name in CHANGELISTS:
+            with self.subTest(changelist=name):
+                with self.assertNumQueries(expected[name]):
+                    response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertGreater(
+                    response.context['cl'].result_count, 3
+                )
@@ -1,7 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
-from django.db import models
+from django.db import connections, models
 from django.db.models import F, Q, UniqueConstraint
+from django.db.models.sql import InsertQuery
 
 
 class User(AbstractUser):
@@ -27,6 +28,16 @@ class User(AbstractUser):
         unique=True,
         validators=(UnicodeUsernameValidator(), )
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('username', )
@@ -37,6 +48,37 @@ class User(AbstractUser):
         return self.username
 
 
+class RelationManager(models.Manager):
+    """
+    Переключатели связей (подписка, избранное, корзина), которые
+    опираются на уникальное ограничение, а не на предварительную проверку.
+    """
+
+    def add(self, **fields):
+        """
+        Вставляет связь одним INSERT, пропуская дубликат.
+        Возвращает True, если строка добавлена.
+        """
+        query = InsertQuery(self.model, ignore_conflicts=True)
+        query.insert_values(
+            [field for field in self.model._meta.concrete_fields
+             if not field.primary_key],
+            [self.model(**fields)],
+        )
+        with connections[self.db].cursor() as cursor:
+            for sql, params in query.get_compiler(using=self.db).as_sql():
+                cursor.execute(sql, params)
+            return cursor.rowcount > 0
+
+    def discard(self, **fields):
+        """
+        Удаляет связь одним DELETE.
+        Возвращает True, если строка была.
+        """
+        deleted, _ = self.filter(**fields).delete()
+        return deleted > 0
+
+
 class Follow(models.Model):
     """Модель подписок пользователей друг на друга."""
     user = models.ForeignKey(
@@ -52,6 +94,8 @@ class Follow(models.Model):
         verbose_name='Автор рецепта',
     )
 
+    objects = RelationManager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'